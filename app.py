@@ -1,75 +1,126 @@
+import os
+from functools import lru_cache
 import spaces
 import torch
 import gradio as gr
-from transformers import AutoProcessor, AutoModelForVision2Seq
-import moviepy.editor as mp
+from transformers import AutoProcessor, AutoModelForVision2Seq, BitsAndBytesConfig
+import cv2
 import numpy as np
 from PIL import Image
 
 # ---------------- MODEL SETUP ----------------
 MODEL_ID = "Qwen/Qwen3-VL-8B-Instruct"
+EMPTY_CACHE = os.getenv("INSPECTRE_EMPTY_CACHE") == "1"
+# Chunks per generate() call; bounds activation/KV-cache memory on long videos
+BATCH_SIZE = max(1, int(os.getenv("INSPECTRE_BATCH_SIZE", "4")))
 
 processor = AutoProcessor.from_pretrained(MODEL_ID)
+# Left padding so batched generate() appends after each prompt
+processor.tokenizer.padding_side = "left"
+
+# FlashAttention-2 when installed, otherwise PyTorch SDPA
+try:
+    import flash_attn  # noqa: F401
+    ATTN_IMPLEMENTATION = "flash_attention_2"
+except ImportError:
+    ATTN_IMPLEMENTATION = "sdpa"
+
+# NF4 weight-only quantization cuts weight bandwidth per decoded token ~4x
+# Set INSPECTRE_QUANTIZE=0 to load full BF16 weights
+quantization_config = None
+if os.getenv("INSPECTRE_QUANTIZE", "1") == "1":
+    try:
+        import bitsandbytes  # noqa: F401
+        quantization_config = BitsAndBytesConfig(
+            load_in_4bit=True,
+            bnb_4bit_quant_type="nf4",
+            bnb_4bit_compute_dtype=torch.bfloat16,
+            bnb_4bit_use_double_quant=True
+        )
+    except ImportError:
+        pass
 
-# Let HF handle device placement safely
+# Let HF handle device placement safely; BF16 avoids FP16 overflow in long attention
 model = AutoModelForVision2Seq.from_pretrained(
     MODEL_ID,
     device_map="auto",
-    torch_dtype=torch.float16
+    torch_dtype=torch.bfloat16,
+    attn_implementation=ATTN_IMPLEMENTATION,
+    quantization_config=quantization_config
 )
+model.eval()
+
+# Set INSPECTRE_COMPILE=1 to compile the forward pass, dropping per-token Python/dispatcher
+# overhead in generate(). Off by default: the dynamic KV cache changes shape every step, so
+# CUDA graphs ("reduce-overhead") would be re-recorded constantly and first calls pay compile time
+COMPILE = os.getenv("INSPECTRE_COMPILE", "0") == "1" and torch.cuda.is_available()
+if COMPILE:
+    model.forward = torch.compile(model.forward, mode="default", fullgraph=False, dynamic=True)
 
 # ---------------- VIDEO UTILITIES ----------------
-def split_video(video_path, chunk_duration=10):
-    """Split video into N-second chunks, resized for memory efficiency"""
-    video = None
-    try:
-        video = mp.VideoFileClip(video_path).resize(height=360)  # keeps aspect ratio
-    except Exception as e:
-        raise RuntimeError(f"Cannot read video: {e}")
+def sample_video(video_path, chunk_duration=10, max_frames=4):
+    """
+    Sample frames for each N-second chunk in a single forward decode pass.
+    Chunks are frame-index ranges only, no per-chunk decoder state or seeks.
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise RuntimeError(f"Cannot read video: {video_path}")
 
-    clips = []
     try:
-        start = 0
-        while start < video.duration:
-            end = min(start + chunk_duration, video.duration)
-            try:
-                clips.append(video.subclip(start, end))
-            except Exception:
-                # Skip corrupted segments
-                start += chunk_duration
-                continue
-            start += chunk_duration
+        fps = cap.get(cv2.CAP_PROP_FPS) or 24
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if total_frames <= 0:
+            raise RuntimeError("Cannot read video: no frames reported")
+
+        # Frame index ranges for each chunk, no decoding needed
+        frames_per_chunk = max(1, int(round(chunk_duration * fps)))
+        ranges = [
+            (start, min(start + frames_per_chunk, total_frames))
+            for start in range(0, total_frames, frames_per_chunk)
+        ]
+        clips = extract_frames(cap, ranges, fps, max_frames=max_frames)
     finally:
-        # Clean up the original video clip to free memory
-        if video is not None:
-            video.close()
-    
-    return clips
-
-def extract_frames(clip, max_frames=4):
-    """Uniformly sample frames from a clip, returns frames and fps"""
-    frames = []
-    num_frames = min(max_frames, max(1, int(clip.duration)))
-    if num_frames == 0:
-        return frames, clip.fps if hasattr(clip, 'fps') else 24
-    
-    # Get fps from clip
-    fps = clip.fps if hasattr(clip, 'fps') and clip.fps is not None else 24
-    
-    for t in np.linspace(0, clip.duration, num_frames, endpoint=False):
-        try:
-            frame = clip.get_frame(t)
-            img = Image.fromarray(frame).convert("RGB")
-            frames.append(img)
-        except Exception:
+        # Release the decoder to free memory
+        cap.release()
+
+    return clips, fps
+
+def extract_frames(cap, ranges, fps, max_frames=4, height=360):
+    """Uniformly sample frames per chunk, retrieving (converting to BGR) only the sampled frames"""
+    # Map each target frame index to the chunk it belongs to
+    targets = {}
+    for chunk, (start, end) in enumerate(ranges):
+        num_frames = min(max_frames, max(1, int((end - start) / fps)))
+        for idx in np.linspace(start, end, num_frames, endpoint=False).astype(int):
+            targets[int(idx)] = chunk
+
+    clips = [[] for _ in ranges]
+    target_size = None  # Computed once; every frame in a video has the same dimensions
+    last_target = max(targets) if targets else -1
+    for i in range(last_target + 1):
+        # grab() reads and decodes; retrieve() only converts the sampled frames
+        if not cap.grab():
+            break
+        chunk = targets.get(i)
+        if chunk is None:
             continue
-    return frames, fps
+        ret, frame = cap.retrieve()
+        if not ret:
+            continue
+        if target_size is None:
+            h, w = frame.shape[:2]
+            target_size = (w * height // h, height)  # keeps aspect ratio
+        # Resize first so the colour conversion runs on the small frame
+        frame = cv2.resize(frame, target_size, interpolation=cv2.INTER_AREA)
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        clips[chunk].append(Image.fromarray(frame))
+    return clips
 
 # ---------------- MODEL CALL ----------------
-def run_qwen(frames, user_prompt, fps=24):
-    """
-    Qwen3-VL multimodal call with video placeholder
-    """
+@lru_cache(maxsize=32)
+def build_chat_text(user_prompt):
+    """Render the chat template for a prompt once; it is identical for every clip"""
     messages = [
         {
             "role": "user",
@@ -81,30 +132,48 @@ def run_qwen(frames, user_prompt, fps=24):
     ]
 
     # Apply Qwen-style chat template to create video tokens
-    text = processor.apply_chat_template(
+    return processor.apply_chat_template(
         messages,
         tokenize=False,
         add_generation_prompt=True
     )
 
-    # Prepare video metadata - fps and total_num_frames are required
-    video_metadata = {
-        "fps": fps,
-        "total_num_frames": len(frames)
-    }
+def run_qwen(frames_list, user_prompt, fps_list):
+    """
+    Batched Qwen3-VL multimodal call with video placeholders.
+    One processor call and one generate() for all the given clips.
+    """
+    texts = [build_chat_text(user_prompt)] * len(frames_list)
+
+    # Prepare video metadata - fps and total_num_frames are required per clip
+    video_metadata = [
+        {"fps": fps, "total_num_frames": len(frames)}
+        for frames, fps in zip(frames_list, fps_list)
+    ]
 
-    # Processor call with video metadata
+    # Single processor call for the whole batch
     inputs = processor(
-        videos=frames,
-        text=text,
+        videos=frames_list,
+        text=texts,
         video_metadata=video_metadata,
+        padding=True,
+        # Bucket lengths so compiled shapes are reused; eager runs would only waste pad tokens
+        pad_to_multiple_of=64 if COMPILE else None,
         return_tensors="pt"
     )
 
-    # Move tensors to model device safely
+    # Move tensors to model device safely, pixel values in the model dtype.
+    # Pinned host memory doubles HtoD bandwidth and lets the copy run asynchronously;
+    # generate() runs on the same stream so it sees the finished copies.
+    pin = torch.cuda.is_available()
     for k, v in inputs.items():
         if isinstance(v, torch.Tensor):
-            inputs[k] = v.to(model.device)
+            if v.is_floating_point():
+                if pin:
+                    v = v.pin_memory()
+                inputs[k] = v.to(model.device, dtype=model.dtype, non_blocking=pin)
+            else:
+                inputs[k] = v.to(model.device, non_blocking=pin)
 
     # Generate with inference mode to save memory
     with torch.inference_mode():
@@ -115,7 +184,7 @@ def run_qwen(frames, user_prompt, fps=24):
             temperature=0.7
         )
 
-    return processor.decode(outputs[0], skip_special_tokens=True)
+    return processor.batch_decode(outputs, skip_special_tokens=True)
 
 # ---------------- SPACES GPU ENTRY ----------------
 @spaces.GPU
@@ -127,37 +196,42 @@ def infer(video_file, prompt):
     video_path = video_file["path"] if isinstance(video_file, dict) else video_file
 
     try:
-        clips = split_video(video_path, chunk_duration=4)
+        clips, fps = sample_video(video_path, chunk_duration=4, max_frames=4)  # 4 frames per 4-second chunk
     except RuntimeError as e:
         return f"Error reading video: {e}"
 
-    responses = []
-    total_chunks = len(clips)
-    
-    for i, clip in enumerate(clips):
+    # Slot per chunk so responses stay in timestamp order
+    responses = [None] * len(clips)
+    batch_indices = []
+    batch_frames = []
+    batch_fps = []
+
+    for i, frames in enumerate(clips):
+        if not frames:
+            responses[i] = f"🕒 {int(i*4)}s–{int((i+1)*4)}s:\n[Error: no frames extracted]"
+            continue
+        batch_indices.append(i)
+        batch_frames.append(frames)
+        batch_fps.append(fps)
+
+    # Micro-batches of BATCH_SIZE chunks; a failed batch only marks its own segments
+    for start in range(0, len(batch_frames), BATCH_SIZE):
+        indices = batch_indices[start:start + BATCH_SIZE]
         try:
-            frames, fps = extract_frames(clip, max_frames=4)  # 4 frames per 4-second chunk
-            if not frames:
-                responses.append(f"🕒 {int(i*4)}s–{int((i+1)*4)}s:\n[Error: no frames extracted]")
-                clip.close()  # Clean up clip
-                continue
-
-            try:
-                answer = run_qwen(frames, prompt, fps=fps)
-                responses.append(f"🕒 {int(i*4)}s–{int((i+1)*4)}s:\n{answer}")
-            except Exception as e:
-                responses.append(f"🕒 {int(i*4)}s–{int((i+1)*4)}s:\n[Error processing segment: {e}]")
-            finally:
-                clip.close()  # Always clean up clip to free memory
-                # Clear GPU cache after each chunk to prevent memory buildup
-                if torch.cuda.is_available():
-                    torch.cuda.empty_cache()
-                
+            answers = run_qwen(
+                batch_frames[start:start + BATCH_SIZE], prompt, batch_fps[start:start + BATCH_SIZE]
+            )
+            for i, answer in zip(indices, answers):
+                responses[i] = f"🕒 {int(i*4)}s–{int((i+1)*4)}s:\n{answer}"
         except Exception as e:
-            responses.append(f"🕒 {int(i*4)}s–{int((i+1)*4)}s:\n[Error with clip: {e}]")
-            if 'clip' in locals():
-                clip.close()
-
+            for i in indices:
+                responses[i] = f"🕒 {int(i*4)}s–{int((i+1)*4)}s:\n[Error processing segment: {e}]"
+        finally:
+            # Emptying the allocator cache is slow and only helps under memory pressure
+            if EMPTY_CACHE and torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+    responses = [r for r in responses if r is not None]
     return "\n\n".join(responses) if responses else "No usable frames found."
 
 # ---------------- GRADIO UI ----------------
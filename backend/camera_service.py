@@ -2,17 +2,228 @@ import cv2
 import threading
 import time
 import os
+import shutil
+import subprocess
+import sys
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from datetime import datetime
 from pathlib import Path
 from typing import Optional, Callable
 import numpy as np
-from queue import Queue
+import collections
 import logging
 
+try:
+    from turbojpeg import TurboJPEG, TJSAMP_420
+    _turbojpeg = TurboJPEG()
+except (ImportError, RuntimeError, OSError):
+    _turbojpeg = None
+
 logger = logging.getLogger(__name__)
 
+# Background subtractor settings: frames of history and squared Mahalanobis distance threshold
+MOTION_BG_HISTORY = 50
+MOTION_BG_VAR_THRESHOLD = 25
+# "mog2" (default) or "running_avg": a cheaper accumulateWeighted background model
+MOTION_BG_MODEL = os.getenv("MOTION_BG_MODEL", "mog2")
+# running_avg settings: background update rate and per-pixel difference threshold
+MOTION_BG_ALPHA = 0.05
+MOTION_DIFF_THRESHOLD = 25
+# Motion detection runs on frames downscaled by this factor per axis
+MOTION_DOWNSCALE = 4
+# Foreground blobs smaller than this (in downscaled pixels) are treated as noise
+MOTION_MIN_BLOB_AREA = 16
+_MOTION_KERNEL = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+# MJPEG frames are only encoded while a client has requested one this recently (seconds)
+MJPEG_VIEWER_TIMEOUT = 2.0
+JPEG_QUALITY = 75
+# Frames waiting for the writer thread (each in its own array, never the reused capture
+# buffer); the oldest is dropped when the writer falls behind
+WRITER_QUEUE_SIZE = 3
+# Default: run motion detection on every Nth grabbed frame (see CameraService motion_skip)
+MOTION_MIN_FRAME_INTERVAL = 3
+# RTSP: a grabbed frame whose stream timestamp trails the live edge by more than
+# RTSP_MAX_LAG_SECONDS came out of a buffer, so up to RTSP_MAX_DRAIN more are grabbed
+# (each grab decodes, so the drain is bounded) before one is used
+RTSP_MAX_LAG_SECONDS = 0.2
+RTSP_MAX_DRAIN = 15
+# Saved clip paths kept for get_pending_clips; the oldest are dropped beyond this
+MAX_PENDING_CLIPS = 1000
+
+# H.264 encoders tried in order: NVIDIA, Intel, Apple hardware, then software
+FFMPEG_ENCODERS = ["h264_nvenc", "h264_qsv", "h264_videotoolbox", "libx264"]
+
+@lru_cache(maxsize=1)
+def _select_ffmpeg_encoder() -> Optional[str]:
+    """Return the first H.264 encoder that works with the installed ffmpeg, or None"""
+    ffmpeg_cmd = shutil.which("ffmpeg")
+    if not ffmpeg_cmd:
+        return None
+    
+    for encoder in FFMPEG_ENCODERS:
+        try:
+            result = subprocess.run(
+                [ffmpeg_cmd, "-loglevel", "error", "-f", "lavfi", "-i", "color=size=256x256",
+                 "-frames:v", "1", "-c:v", encoder, "-f", "null", "-"],
+                capture_output=True,
+                timeout=10
+            )
+            if result.returncode == 0:
+                logger.info(f"Using ffmpeg encoder for recordings: {encoder}")
+                return encoder
+        except (subprocess.TimeoutExpired, OSError) as e:
+            logger.debug(f"Encoder probe failed for {encoder}: {e}")
+    return None
+
+def _opencv_writer_configs() -> list:
+    """OpenCV VideoWriter fallbacks as (extension, fourcc, params), best first"""
+    configs = []
+    # OpenCV 4.5.2+ can ask its FFmpeg backend for a hardware H.264 encoder
+    if hasattr(cv2, "VIDEOWRITER_PROP_HW_ACCELERATION"):
+        configs.append(("mp4", "avc1", [
+            cv2.VIDEOWRITER_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY,
+        ]))
+    configs.append(("avi", "XVID", None))
+    configs.append(("avi", "MJPG", None))
+    return configs
+
+def _encode_jpeg(frame: np.ndarray) -> Optional[bytes]:
+    """Encode a BGR frame as JPEG, using libjpeg-turbo directly when available"""
+    if _turbojpeg is not None:
+        return _turbojpeg.encode(frame, quality=JPEG_QUALITY, jpeg_subsample=TJSAMP_420)
+    ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    return buffer.tobytes() if ret else None
+
+def _probe_camera(index: int) -> tuple:
+    """Open a camera index and try to read one frame"""
+    cap = cv2.VideoCapture(index)
+    try:
+        ok = cap.isOpened() and cap.read()[0]
+    except cv2.error:
+        # A misbehaving backend must not abort the whole parallel probe
+        ok = False
+    finally:
+        cap.release()
+    return index, ok
+
+def _enumerate_cameras() -> Optional[list]:
+    """List cameras through the OS device API without opening them, or None if unsupported"""
+    if sys.platform.startswith("linux"):
+        sysfs = Path("/sys/class/video4linux")
+        if not sysfs.exists():
+            return None
+        cameras = []
+        for node in sysfs.glob("video*"):
+            try:
+                # Each camera also exposes metadata nodes; only index 0 captures frames
+                if (node / "index").exists() and (node / "index").read_text().strip() != "0":
+                    continue
+                name = (node / "name").read_text().strip()
+                index = int(node.name[len("video"):])
+            except (OSError, ValueError):
+                continue
+            cameras.append({"index": index, "name": name or f"Camera {index}"})
+        return sorted(cameras, key=lambda cam: cam["index"])
+    
+    if sys.platform == "win32":
+        try:
+            from pygrabber.dshow_graph import FilterGraph
+        except ImportError:
+            return None
+        devices = FilterGraph().get_input_devices()
+        return [{"index": i, "name": name} for i, name in enumerate(devices)]
+    
+    if sys.platform == "darwin":
+        try:
+            import AVFoundation
+        except ImportError:
+            return None
+        devices = AVFoundation.AVCaptureDevice.devicesWithMediaType_(AVFoundation.AVMediaTypeVideo)
+        return [{"index": i, "name": str(device.localizedName())} for i, device in enumerate(devices)]
+    
+    return None
+
+class _RunningAverageSubtractor:
+    """Running-average background model with the BackgroundSubtractor apply() interface"""
+    
+    def __init__(self, alpha: float = MOTION_BG_ALPHA, threshold: int = MOTION_DIFF_THRESHOLD):
+        self.alpha = alpha
+        self.threshold = threshold
+        self._bg: Optional[np.ndarray] = None
+        self._bg_u8: Optional[np.ndarray] = None
+        self._diff: Optional[np.ndarray] = None
+    
+    def apply(self, gray: np.ndarray, fgmask: Optional[np.ndarray] = None) -> np.ndarray:
+        if self._bg is None or self._bg.shape != gray.shape:
+            # Seed the model with the first frame; buffers are reused afterwards
+            self._bg = gray.astype(np.float32)
+            self._bg_u8 = np.empty_like(gray)
+            self._diff = np.empty_like(gray)
+        if fgmask is None:
+            fgmask = np.empty_like(gray)
+        
+        cv2.accumulateWeighted(gray, self._bg, self.alpha)
+        cv2.convertScaleAbs(self._bg, dst=self._bg_u8)
+        cv2.absdiff(gray, self._bg_u8, dst=self._diff)
+        cv2.threshold(self._diff, self.threshold, 255, cv2.THRESH_BINARY, dst=fgmask)
+        return fgmask
+
+class FFmpegWriter:
+    """cv2.VideoWriter-compatible writer that pipes raw BGR frames to an ffmpeg process"""
+    
+    def __init__(self, path: str, encoder: str, fps: int, frame_size: tuple):
+        width, height = frame_size
+        cmd = [
+            shutil.which("ffmpeg") or "ffmpeg",
+            "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "bgr24",
+            "-s", f"{width}x{height}", "-r", str(fps),
+            "-i", "-",
+            "-c:v", encoder,
+            "-pix_fmt", "yuv420p",
+            "-movflags", "+faststart",  # Enable fast start for HTTP streaming
+        ]
+        if encoder == "libx264":
+            cmd += ["-preset", "ultrafast"]
+        elif encoder == "h264_nvenc":
+            cmd += ["-preset", "p4"]
+        cmd.append(path)
+        
+        try:
+            self.proc: Optional[subprocess.Popen] = subprocess.Popen(
+                cmd,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL
+            )
+        except OSError as e:
+            logger.error(f"Failed to start ffmpeg: {e}")
+            self.proc = None
+    
+    def isOpened(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+    
+    def write(self, frame: np.ndarray):
+        self.proc.stdin.write(np.ascontiguousarray(frame).data)
+    
+    def release(self):
+        if self.proc is None:
+            return
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+        self.proc = None
+
 class CameraService:
-    def __init__(self, recordings_dir: str = "backend/backend/recordings"):
+    def __init__(self, recordings_dir: str = "backend/backend/recordings",
+                 motion_skip: int = MOTION_MIN_FRAME_INTERVAL - 1):
         # Resolve to absolute path to avoid issues with working directory
         # If running from backend/ directory, "backend/backend/recordings" resolves to:
         # C:\Users\xserv\Documents\CustomAPI\backend\backend\backend\recordings
@@ -21,6 +232,8 @@ class CameraService:
         logger.info(f"Recordings directory set to: {self.recordings_dir}")
         
         self.cap: Optional[cv2.VideoCapture] = None
+        # Grabbed frames skipped between motion detection runs (0 = every frame)
+        self.motion_skip = max(0, motion_skip)
         self.is_streaming = False
         self.is_recording = False
         self.motion_detected = False
@@ -29,37 +242,74 @@ class CameraService:
         self.motion_threshold = 5000
         
         self.stream_thread: Optional[threading.Thread] = None
+        # Set by stop_stream so the stream loop's error back-off returns immediately
+        self._stop_event = threading.Event()
         self.recording_thread: Optional[threading.Thread] = None
-        self.motion_thread: Optional[threading.Thread] = None
-        
-        self.frame_queue = Queue(maxsize=10)
+        self.writer_thread: Optional[threading.Thread] = None
+        
+        # Reused buffer the stream thread retrieves frames into; nothing holds it past one
+        # loop iteration (frames bound for the writer thread get their own array)
+        self._frame_buf: Optional[np.ndarray] = None
+        
+        # Latest frame as JPEG, encoded once by the stream loop and shared by all MJPEG clients
+        self._latest_jpeg: Optional[bytes] = None
+        self._jpeg_encoded_at = 0.0
+        self._jpeg_lock = threading.Lock()
+        self._jpeg_requested_at = 0.0
+        # Frames for the writer thread as (writer, frame); the oldest is dropped when full
+        self._record_ring: collections.deque = collections.deque(maxlen=WRITER_QUEUE_SIZE)
+        # Control items for the writer thread: (writer, Event) to release a writer, None to exit
+        self._record_control: collections.deque = collections.deque()
+        self._record_cond = threading.Condition()
+        self.dropped_frames = 0  # Frames dropped from the current recording
+        
+        # Cached from the first decoded frame so recording never touches self.cap
+        self._frame_shape: Optional[tuple] = None
+        self._fps: Optional[int] = None
+        # Smallest (wall clock - stream timestamp) seen for the RTSP stream, i.e. a live frame
+        self._rtsp_offset: Optional[float] = None
         self.motion_callback: Optional[Callable] = None
         self.progress_callback: Optional[Callable] = None
         
-        self.recording_writer: Optional[cv2.VideoWriter] = None
+        self.recording_writer = None  # cv2.VideoWriter or FFmpegWriter
         self.recording_start_time: Optional[float] = None
         self.recording_duration = 16.0  # 16 seconds
         self.current_recording_path: Optional[str] = None
+        self._recording_tmp_path: Optional[str] = None  # File the writer is encoding into
+        # Writer opened ahead of time for the next clip: (key, writer, path, description)
+        self._warm_writer: Optional[tuple] = None
+        self._warm_lock = threading.Lock()
+        # OpenCV fallback (extension, fourcc, params) that opened successfully; availability
+        # doesn't change at runtime
+        self._cached_writer_config: Optional[tuple] = None
         self.recording_lock = threading.Lock()  # Lock to prevent race conditions
         
-        self.last_frame: Optional[np.ndarray] = None
-        self.processed_clips = []
-        
+        self._bg_subtractor = self._create_bg_subtractor()
+        self._bg_initialized = False
+        self._reset_buffers()
+        self.processed_clips = collections.deque(maxlen=MAX_PENDING_CLIPS)
+        
+    def _reset_buffers(self):
+        """Drop the reused motion-detection buffers; reallocated once the frame size is known"""
+        self._small: Optional[np.ndarray] = None
+        self._gray: Optional[np.ndarray] = None
+        self._fg_mask: Optional[np.ndarray] = None
+        self._fg_clean: Optional[np.ndarray] = None
+    
     def list_cameras(self) -> list:
         """List available cameras"""
-        cameras = []
-        # Try first 10 camera indices
-        for i in range(10):
-            cap = cv2.VideoCapture(i)
-            if cap.isOpened():
-                ret, _ = cap.read()
-                if ret:
-                    cameras.append({
-                        "index": i,
-                        "name": f"Camera {i}"
-                    })
-                cap.release()
-        return cameras
+        try:
+            cameras = _enumerate_cameras()
+        except Exception as e:
+            logger.warning(f"Camera enumeration failed, probing indices instead: {e}")
+            cameras = None
+        if cameras is not None:
+            return cameras
+        
+        # Fallback: probe the first 10 camera indices concurrently
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            results = list(executor.map(_probe_camera, range(10)))
+        return [{"index": i, "name": f"Camera {i}"} for i, ok in results if ok]
     
     def start_stream(self, camera_index: Optional[int] = None, rtsp_url: Optional[str] = None, 
                     motion_threshold: int = 5000, 
@@ -80,6 +330,15 @@ class CameraService:
         self.motion_callback = motion_callback
         self.progress_callback = progress_callback
         
+        self._bg_subtractor = self._create_bg_subtractor()
+        self._bg_initialized = False
+        self._reset_buffers()
+        with self._jpeg_lock:
+            self._latest_jpeg = None
+        self._frame_shape = None
+        self._fps = None
+        self._rtsp_offset = None
+        
         # Open video source (camera index or RTSP URL)
         if rtsp_url:
             # Open RTSP stream (OpenCV will use available backend - FFMPEG, GStreamer, etc.)
@@ -139,16 +398,35 @@ class CameraService:
         if rtsp_url:
             self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
         
+        # Set before the prewarm thread starts, which discards its writer if the stream is down
         self.is_streaming = True
         
-        # Start streaming thread
+        # Query the driver once per session; recording never touches self.cap
+        self._fps = int(self.cap.get(cv2.CAP_PROP_FPS)) or 30
+        width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        if width and height:
+            self._frame_shape = (height, width)
+            # Have a writer ready before the first motion event
+            threading.Thread(
+                target=self._prewarm_writer, args=((width, height, self._fps),), daemon=True
+            ).start()
+        
+        # Start recording writer thread (a previous one may linger if the stream loop died)
+        if self.writer_thread and self.writer_thread.is_alive():
+            self._send_writer_control(None)
+            self.writer_thread.join(timeout=2.0)
+        with self._record_cond:
+            self._record_ring.clear()
+            self._record_control.clear()
+        self.writer_thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self.writer_thread.start()
+        
+        # Start streaming thread (capture and motion detection run inline)
+        self._stop_event.clear()
         self.stream_thread = threading.Thread(target=self._stream_loop, daemon=True)
         self.stream_thread.start()
         
-        # Start motion detection thread
-        self.motion_thread = threading.Thread(target=self._motion_detection_loop, daemon=True)
-        self.motion_thread.start()
-        
         source_info = f"RTSP: {rtsp_url}" if rtsp_url else f"Camera {camera_index}"
         logger.info(f"Started streaming from {source_info}")
     
@@ -156,6 +434,7 @@ class CameraService:
         """Stop streaming and recording"""
         logger.info("Stopping stream...")
         self.is_streaming = False
+        self._stop_event.set()
         
         # Stop any active recording properly
         if self.is_recording:
@@ -184,73 +463,105 @@ class CameraService:
         # Wait for threads to finish
         if self.stream_thread and self.stream_thread.is_alive():
             self.stream_thread.join(timeout=2.0)
-        if self.motion_thread and self.motion_thread.is_alive():
-            self.motion_thread.join(timeout=2.0)
         if hasattr(self, 'recording_thread') and self.recording_thread and self.recording_thread.is_alive():
             self.recording_thread.join(timeout=2.0)
+        if self.writer_thread and self.writer_thread.is_alive():
+            self._send_writer_control(None)
+            self.writer_thread.join(timeout=2.0)
+        
+        # Drop the pre-opened writer for the next clip
+        with self._warm_lock:
+            warm, self._warm_writer = self._warm_writer, None
+        if warm is not None:
+            self._discard_writer(warm[1], warm[2])
         
         logger.info("Stopped streaming")
     
     def _stream_loop(self):
-        """Main streaming loop"""
+        """Main streaming loop - captures frames and runs motion detection inline"""
         consecutive_errors = 0
         max_consecutive_errors = 10
+        grab_count = 0
         
         while self.is_streaming and self.cap is not None:
             try:
-                ret, frame = self.cap.read()
+                # grab() reads and decodes; retrieve() converts the frame into a BGR buffer
+                ret = self.cap.grab()
+                frame = None
+                if ret:
+                    grab_count += 1
+                    run_motion = grab_count % (self.motion_skip + 1) == 0
+                    viewer_active = time.time() - self._jpeg_requested_at < MJPEG_VIEWER_TIMEOUT
+                    # Only retrieve frames that will be recorded, analysed or streamed
+                    if not (self.is_recording or run_motion or viewer_active):
+                        continue
+                    # RTSP backends may ignore CAP_PROP_BUFFERSIZE; skip stale buffered frames so
+                    # only a live one is retrieved (recordings keep every frame)
+                    if self.current_rtsp_url and not self.is_recording:
+                        for _ in range(RTSP_MAX_DRAIN):
+                            if self._rtsp_lag() <= RTSP_MAX_LAG_SECONDS or not self.cap.grab():
+                                break
+                            grab_count += 1
+                    # Frames for the writer outlive this iteration, so they get a fresh array from
+                    # retrieve() instead of a copy; others go straight into the reused buffer
+                    # (reallocated only if the shape changes)
+                    fresh = self.is_recording and self.recording_writer is not None
+                    ret, frame = self.cap.retrieve(None if fresh else self._frame_buf)
                 if ret and frame is not None:
                     consecutive_errors = 0  # Reset error counter on success
-                    # Put frame in queue (drop if full)
-                    if not self.frame_queue.full():
-                        self.frame_queue.put(frame.copy())
+                    if frame.shape[:2] != self._frame_shape:
+                        # Size unknown to the driver (common for RTSP) or different from
+                        # what it reported; warm a writer for the real one
+                        self._frame_shape = frame.shape[:2]
+                        height, width = self._frame_shape
+                        threading.Thread(
+                            target=self._prewarm_writer, args=((width, height, self._fps),), daemon=True
+                        ).start()
+                    if not fresh:
+                        self._frame_buf = frame
                     
-                    # If recording, write frame
-                    if self.is_recording and self.recording_writer is not None:
-                        try:
-                            self.recording_writer.write(frame)
-                        except (cv2.error, Exception) as e:
-                            error_msg = str(e)
-                            # Check if it's the FFmpeg threading assertion error
-                            if "async_lock" in error_msg or "Assertion" in error_msg:
-                                logger.error(f"FFmpeg threading error (async_lock assertion): {error_msg}")
-                                logger.warning("This is usually caused by race conditions - stopping current recording")
-                            else:
-                                logger.error(f"Error writing frame to video: {e}")
-                            
-                            # Stop recording if we can't write frames
-                            try:
-                                if self.recording_writer is not None:
-                                    self.recording_writer.release()
-                            except:
-                                pass
-                            finally:
-                                self.recording_writer = None
-                            
-                            with self.recording_lock:
-                                self.is_recording = False
-                            
-                            logger.info("Recording stopped due to write error - will attempt to restart on next motion")
+                    # Encode once for all MJPEG clients, only while someone is watching
+                    if viewer_active:
+                        jpeg = _encode_jpeg(frame)
+                        if jpeg is not None:
+                            with self._jpeg_lock:
+                                self._latest_jpeg = jpeg
+                                self._jpeg_encoded_at = time.time()
+                    
+                    # If recording, hand the frame to the writer thread (dropping the oldest if it
+                    # is behind); copied only if recording began after it went into the reused buffer
+                    writer = self.recording_writer
+                    if self.is_recording and writer is not None:
+                        recorded = frame if fresh else frame.copy()
+                        with self._record_cond:
+                            if len(self._record_ring) == WRITER_QUEUE_SIZE:
+                                self.dropped_frames += 1
+                            self._record_ring.append((writer, recorded))
+                            self._record_cond.notify()
+                    
+                    # OpenCV releases the GIL inside its calls, so detecting inline is cheap
+                    if run_motion:
+                        self._detect_motion(frame)
                 else:
                     consecutive_errors += 1
                     if consecutive_errors >= max_consecutive_errors:
                         logger.error(f"Failed to read {consecutive_errors} consecutive frames. Stream may be broken.")
                         break
-                    time.sleep(0.1)
+                    self._stop_event.wait(0.1)
             except cv2.error as e:
                 logger.error(f"OpenCV error in stream loop: {e}")
                 consecutive_errors += 1
                 if consecutive_errors >= max_consecutive_errors:
                     logger.error("Too many OpenCV errors. Stopping stream loop.")
                     break
-                time.sleep(0.5)  # Wait longer after OpenCV errors
+                self._stop_event.wait(0.5)  # Wait longer after OpenCV errors
             except Exception as e:
                 logger.error(f"Unexpected error in stream loop: {e}")
                 consecutive_errors += 1
                 if consecutive_errors >= max_consecutive_errors:
                     logger.error("Too many errors. Stopping stream loop.")
                     break
-                time.sleep(0.5)
+                self._stop_event.wait(0.5)
         
         # Clean up if loop exits due to errors
         if self.is_streaming:
@@ -263,130 +574,308 @@ class CameraService:
                     logger.error(f"Error stopping recording during cleanup: {e}")
             self.is_streaming = False
     
-    def _motion_detection_loop(self):
-        """Motion detection loop using frame differencing"""
-        while self.is_streaming:
-            if self.frame_queue.empty():
-                time.sleep(0.05)
-                continue
-            
-            current_frame = self.frame_queue.get()
-            
-            if self.last_frame is None:
-                self.last_frame = cv2.cvtColor(current_frame, cv2.COLOR_BGR2GRAY)
-                continue
-            
-            # Convert to grayscale
-            gray_current = cv2.cvtColor(current_frame, cv2.COLOR_BGR2GRAY)
-            
-            # Calculate frame difference
-            frame_diff = cv2.absdiff(self.last_frame, gray_current)
-            
-            # Apply threshold
-            _, thresh = cv2.threshold(frame_diff, 30, 255, cv2.THRESH_BINARY)
-            
-            # Count non-zero pixels
-            motion_pixels = cv2.countNonZero(thresh)
-            
-            # Check if motion detected
-            motion_detected = motion_pixels > self.motion_threshold
-            
-            if motion_detected != self.motion_detected:
-                self.motion_detected = motion_detected
-                if self.motion_callback:
-                    self.motion_callback(motion_detected)
-            
-            # If motion detected and not recording, start recording
-            if motion_detected and not self.is_recording:
-                self._start_recording()
-            
-            # Update last frame
-            self.last_frame = gray_current
+    def _rtsp_lag(self) -> float:
+        """Seconds the last grabbed frame trails the live edge, from its stream timestamp"""
+        position = self.cap.get(cv2.CAP_PROP_POS_MSEC)
+        if position <= 0:
+            return 0.0  # No timestamps from this backend; nothing to go on
+        offset = time.monotonic() - position / 1000.0
+        if self._rtsp_offset is None or offset < self._rtsp_offset:
+            self._rtsp_offset = offset
+        return offset - self._rtsp_offset
+    
+    @staticmethod
+    def _create_bg_subtractor():
+        if MOTION_BG_MODEL == "running_avg":
+            return _RunningAverageSubtractor()
+        return cv2.createBackgroundSubtractorMOG2(
+            history=MOTION_BG_HISTORY,
+            varThreshold=MOTION_BG_VAR_THRESHOLD,
+            detectShadows=False
+        )
+    
+    def _detect_motion(self, current_frame: np.ndarray):
+        """Motion detection against a running background model (MOG2 by default)"""
+        height, width = current_frame.shape[:2]
+        small_size = (width // MOTION_DOWNSCALE, height // MOTION_DOWNSCALE)
+        if self._small is None or self._small.shape[:2] != small_size[::-1]:
+            self._small = np.empty((small_size[1], small_size[0], 3), np.uint8)
+            self._gray = np.empty(small_size[::-1], np.uint8)
+            self._fg_mask = np.empty(small_size[::-1], np.uint8)
+            self._fg_clean = np.empty(small_size[::-1], np.uint8)
+        
+        # Downscale before taking luma - full resolution is only needed for recording.
+        # All outputs go to preallocated buffers small enough to stay in cache.
+        cv2.resize(current_frame, small_size, dst=self._small, interpolation=cv2.INTER_AREA)
+        # The green channel is a cheap luma proxy, a plain copy instead of a weighted sum
+        cv2.extractChannel(self._small, 1, dst=self._gray)
+        
+        # Single C++ pass: update the background model and mark foreground pixels
+        fg_mask = self._bg_subtractor.apply(self._gray, fgmask=self._fg_mask)
+        if not self._bg_initialized:
+            # The first frame only seeds the model - everything is foreground
+            self._bg_initialized = True
+            return
+        
+        # Morphological open removes sensor-noise speckle and flicker
+        cv2.morphologyEx(fg_mask, cv2.MORPH_OPEN, _MOTION_KERNEL, dst=self._fg_clean)
+        
+        # Threshold is in full-resolution pixels; skip contour analysis when even the
+        # whole mask is below it
+        scale = MOTION_DOWNSCALE * MOTION_DOWNSCALE
+        motion_detected = cv2.countNonZero(self._fg_clean) * scale > self.motion_threshold
+        if motion_detected:
+            # Only count blobs large enough to be real moving objects
+            contours, _ = cv2.findContours(self._fg_clean, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            motion_area = sum(
+                area for area in map(cv2.contourArea, contours) if area > MOTION_MIN_BLOB_AREA
+            )
+            motion_detected = motion_area * scale > self.motion_threshold
+        
+        if motion_detected != self.motion_detected:
+            self.motion_detected = motion_detected
+            if self.motion_callback:
+                self.motion_callback(motion_detected)
+        
+        # If motion detected and not recording, start recording
+        if motion_detected and not self.is_recording:
+            self._start_recording(current_frame)
     
-    def _start_recording(self):
-        """Start recording a 16-second clip"""
+    def _start_recording(self, first_frame: np.ndarray):
+        """Start recording a 16-second clip, beginning with the frame that triggered it"""
         with self.recording_lock:
             if self.is_recording:
                 return
-            
-            # Wait for any previous recording thread to finish
-            if hasattr(self, 'recording_thread') and self.recording_thread is not None:
-                if self.recording_thread.is_alive():
-                    logger.debug("Waiting for previous recording thread to finish...")
-                    self.recording_thread.join(timeout=1.0)
-            
             self.is_recording = True
+            self.dropped_frames = 0
+            previous = self.recording_thread
+            # Runs on the capture thread, so waiting on the previous clip and opening the
+            # writer happen on the recording thread (copying the frame out of the capture buffer)
+            self.recording_thread = threading.Thread(
+                target=self._recording_loop, args=(first_frame.copy(), previous), daemon=True
+            )
+            self.recording_thread.start()
+    
+    def _is_current_recording(self) -> bool:
+        """Whether the calling recording thread still owns the active recording"""
+        return self.is_recording and self.recording_thread is threading.current_thread()
+    
+    def _recording_loop(self, first_frame: np.ndarray, previous: Optional[threading.Thread]):
+        """Open the clip's writer, then stop the clip after the recording duration"""
+        # Wait for any previous recording thread to finish
+        if previous is not None and previous.is_alive():
+            logger.debug("Waiting for previous recording thread to finish...")
+            previous.join(timeout=1.0)
         
-        # Release lock before file operations
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        self.current_recording_path = str(self.recordings_dir / f"clip_{timestamp}.avi")
-        
-        # Get frame dimensions
-        ret, frame = self.cap.read()
-        if not ret:
+        # Verify the directory exists and is writable
+        if not self.recordings_dir.exists():
+            logger.error(f"Recordings directory does not exist: {self.recordings_dir}")
             with self.recording_lock:
-                self.is_recording = False
+                if self._is_current_recording():
+                    self.is_recording = False
             return
         
-        height, width = frame.shape[:2]
-        fps = int(self.cap.get(cv2.CAP_PROP_FPS)) or 30
-        
-        # Initialize video writer - use AVI format with XVID codec (skip H.264 to avoid errors)
-        fourcc = cv2.VideoWriter_fourcc(*'XVID')
-        successful_codec = 'XVID'
-        self.recording_writer = cv2.VideoWriter(
-            self.current_recording_path,
-            fourcc,
-            fps,
-            (width, height)
-        )
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         
-        # If XVID fails, try MJPG as fallback (works with AVI)
-        if not self.recording_writer.isOpened():
-            logger.warning("XVID codec failed, trying MJPG")
-            fourcc = cv2.VideoWriter_fourcc(*'MJPG')
-            successful_codec = 'MJPG'
-            self.recording_writer = cv2.VideoWriter(
-                self.current_recording_path,
-                fourcc,
-                fps,
-                (width, height)
-            )
+        # Frame dimensions come from the triggering frame, fps is cached by start_stream
+        height, width = first_frame.shape[:2]
+        fps = self._fps or 30
         
-        # Verify writer is working
-        if not self.recording_writer.isOpened():
-            logger.error("Failed to open video writer with XVID or MJPG codec")
+        # Use the writer opened ahead of time if it matches, otherwise open one now
+        key = (width, height, fps)
+        opened = self._take_writer(key)
+        if opened is None:
+            logger.error("Failed to open video writer with ffmpeg, XVID or MJPG codec")
             logger.error("Recording aborted - no valid video codec available")
             with self.recording_lock:
-                self.is_recording = False
-            self.current_recording_path = None
-            self.recording_start_time = None
+                if self._is_current_recording():
+                    self.is_recording = False
             return
         
-        logger.info(f"Video writer initialized successfully (format: AVI, codec: {successful_codec})")
-        
+        writer, tmp_path, description = opened
+        extension = os.path.splitext(tmp_path)[1]
+        clip_path = str(self.recordings_dir / f"clip_{timestamp}{extension}")
         with self.recording_lock:
-            self.recording_start_time = time.time()
-        
-        # Verify the directory exists and is writable
-        if not self.recordings_dir.exists():
-            logger.error(f"Recordings directory does not exist: {self.recordings_dir}")
-            with self.recording_lock:
-                self.is_recording = False
+            stopped = not self._is_current_recording()
+            if not stopped:
+                self._recording_tmp_path = tmp_path
+                self.current_recording_path = clip_path
+                # Start the clip with the frame that triggered it so the motion onset isn't lost
+                with self._record_cond:
+                    self._record_ring.append((writer, first_frame))
+                    self._record_cond.notify()
+                self.recording_writer = writer
+                self.recording_start_time = time.time()
+        if stopped:
+            # Stopped (or the stream closed) while the writer was opening
+            self._discard_writer(writer, tmp_path)
             return
+        logger.info(f"Video writer initialized successfully ({description})")
         
-        # Start recording thread
-        self.recording_thread = threading.Thread(target=self._recording_timer, daemon=True)
-        self.recording_thread.start()
+        # Open the next clip's writer in the background so motion onset doesn't wait on encoder start-up
+        threading.Thread(target=self._prewarm_writer, args=(key,), daemon=True).start()
         
-        logger.info(f"Started recording to: {self.current_recording_path}")
+        logger.info(f"Started recording to: {clip_path}")
+        self._recording_timer()
+    
+    def _open_writer(self, width: int, height: int, fps: int) -> Optional[tuple]:
+        """Open a video writer on a temporary file, returns (writer, path, description) or None"""
+        stem = self.recordings_dir / f".pending_{uuid.uuid4().hex}"
+        
+        # Prefer H.264 MP4 through ffmpeg (hardware encoder when available)
+        encoder = _select_ffmpeg_encoder()
+        if encoder:
+            path = f"{stem}.mp4"
+            writer = FFmpegWriter(path, encoder, fps, (width, height))
+            if writer.isOpened():
+                return writer, path, f"format: MP4, codec: {encoder}"
+            logger.warning(f"ffmpeg {encoder} writer failed, falling back to OpenCV")
+        
+        # Fall back to OpenCV's VideoWriter - hardware H.264 MP4, then AVI with XVID or MJPG
+        configs = [self._cached_writer_config] if self._cached_writer_config else _opencv_writer_configs()
+        for config in configs:
+            extension, codec, params = config
+            path = f"{stem}.{extension}"
+            fourcc = cv2.VideoWriter_fourcc(*codec)
+            try:
+                if params:
+                    writer = cv2.VideoWriter(path, cv2.CAP_FFMPEG, fourcc, fps, (width, height), params)
+                else:
+                    writer = cv2.VideoWriter(path, fourcc, fps, (width, height))
+            except cv2.error as e:
+                logger.warning(f"{codec} codec failed: {e}")
+                continue
+            if writer.isOpened():
+                self._cached_writer_config = config
+                return writer, path, f"format: {extension.upper()}, codec: {codec}"
+            writer.release()
+            if os.path.exists(path):
+                os.remove(path)
+            logger.warning(f"{codec} codec failed")
+        # Probe again next time in case the cached codec stopped working
+        self._cached_writer_config = None
+        return None
+    
+    def _take_writer(self, key: tuple) -> Optional[tuple]:
+        """Take the pre-opened writer if it matches the frame format, otherwise open a new one"""
+        with self._warm_lock:
+            warm, self._warm_writer = self._warm_writer, None
+        if warm is not None:
+            warm_key, writer, path, description = warm
+            if warm_key == key and writer.isOpened():
+                return writer, path, description
+            self._discard_writer(writer, path)
+        return self._open_writer(*key)
+    
+    def _prewarm_writer(self, key: tuple):
+        """Open the writer for the next clip ahead of time"""
+        opened = self._open_writer(*key)
+        if opened is None:
+            return
+        if not self.is_streaming:
+            self._discard_writer(opened[0], opened[1])
+            return
+        with self._warm_lock:
+            previous, self._warm_writer = self._warm_writer, (key, *opened)
+        if previous is not None:
+            self._discard_writer(previous[1], previous[2])
+    
+    def _discard_writer(self, writer, path: str):
+        """Release an unused writer and delete its empty file"""
+        try:
+            writer.release()
+        except Exception:
+            pass
+        try:
+            Path(path).unlink(missing_ok=True)
+        except OSError as e:
+            logger.warning(f"Could not delete unused recording file {path}: {e}")
+    
+    def _writer_loop(self):
+        """Encode queued frames off the capture thread"""
+        failed_writer = None
+        released_writer = None
+        while True:
+            with self._record_cond:
+                self._record_cond.wait_for(lambda: self._record_ring or self._record_control)
+                # Frames first, so a release marker is handled after the frames queued before it
+                if self._record_ring:
+                    item, is_control = self._record_ring.popleft(), False
+                else:
+                    item, is_control = self._record_control.popleft(), True
+            
+            if is_control:
+                if item is None:
+                    break
+                writer, released = item
+                try:
+                    writer.release()
+                except Exception as e:
+                    logger.error(f"Error releasing video writer: {e}")
+                released_writer = writer
+                released.set()
+                continue
+            
+            writer, frame = item
+            if writer is failed_writer or writer is released_writer:
+                continue
+            
+            try:
+                writer.write(frame)
+            except (cv2.error, Exception) as e:
+                error_msg = str(e)
+                # Check if it's the FFmpeg threading assertion error
+                if "async_lock" in error_msg or "Assertion" in error_msg:
+                    logger.error(f"FFmpeg threading error (async_lock assertion): {error_msg}")
+                    logger.warning("This is usually caused by race conditions - stopping current recording")
+                else:
+                    logger.error(f"Error writing frame to video: {e}")
+                
+                # Stop recording if we can't write frames
+                failed_writer = writer
+                try:
+                    writer.release()
+                except:
+                    pass
+                tmp_path = None
+                with self.recording_lock:
+                    # Otherwise _stop_recording already took this clip and finalizes it
+                    if self.recording_writer is writer:
+                        tmp_path = self._recording_tmp_path
+                        self.is_recording = False
+                        self.recording_writer = None
+                        self.current_recording_path = None
+                        self._recording_tmp_path = None
+                        self.recording_start_time = None
+                if tmp_path:
+                    # The clip is cut short mid-stream and likely unplayable
+                    self._discard_writer(writer, tmp_path)
+                
+                logger.info("Recording stopped due to write error - will attempt to restart on next motion")
+    
+    def _send_writer_control(self, item: Optional[tuple]):
+        with self._record_cond:
+            self._record_control.append(item)
+            self._record_cond.notify()
+    
+    def _release_writer(self, writer):
+        """Release a writer once the writer thread has flushed its queued frames"""
+        if self.writer_thread is not None and self.writer_thread.is_alive():
+            released = threading.Event()
+            self._send_writer_control((writer, released))
+            if released.wait(timeout=5.0):
+                return
+            logger.warning("Timed out waiting for writer thread to flush, releasing directly")
+        writer.release()
     
     def _recording_timer(self):
         """Timer for 16-second recording duration"""
-        while self.is_recording and (time.time() - self.recording_start_time) < self.recording_duration:
+        # Read once: _stop_recording clears it from other threads
+        start_time = self.recording_start_time or time.time()
+        while self._is_current_recording() and (time.time() - start_time) < self.recording_duration:
             time.sleep(0.5)
         
-        if self.is_recording:
+        if self._is_current_recording():
             self._stop_recording()
             # Small delay to allow file system and FFmpeg to fully release resources
             time.sleep(0.2)
@@ -397,17 +886,36 @@ class CameraService:
             if not self.is_recording:
                 return
             
+            # Take this clip's state and clear it at once, so a recording started while this
+            # one is finalized keeps its own writer and paths
+            writer = self.recording_writer
             saved_path = self.current_recording_path
+            tmp_path = self._recording_tmp_path
+            dropped_frames = self.dropped_frames
             self.is_recording = False  # Stop accepting new frames immediately
+            self.recording_writer = None
+            self.current_recording_path = None
+            self._recording_tmp_path = None
+            self.recording_start_time = None
         
         # Release lock before file operations
         
-        if self.recording_writer is not None:
+        if writer is not None:
             try:
-                self.recording_writer.release()
+                self._release_writer(writer)
             except Exception as e:
                 logger.error(f"Error releasing video writer: {e}")
-            self.recording_writer = None
+        
+        # Writers are opened on a temporary file ahead of time; give it the clip's name
+        if saved_path and tmp_path:
+            try:
+                os.replace(tmp_path, saved_path)
+            except OSError as e:
+                logger.error(f"Could not rename {tmp_path} to {saved_path}: {e}")
+                saved_path = tmp_path
+        
+        if dropped_frames:
+            logger.warning(f"Dropped {dropped_frames} frames from {saved_path} - writer could not keep up")
         
         if saved_path:
             # Give AVI files more time to finalize (they take longer than MP4)
@@ -457,25 +965,17 @@ class CameraService:
                         video_path.unlink()
                 except Exception as e:
                     logger.warning(f"Could not delete invalid file: {e}")
-        
-        # Clear state with lock
-        with self.recording_lock:
-            self.current_recording_path = None
-            self.recording_start_time = None
     
     def get_latest_frame(self) -> Optional[bytes]:
         """Get latest frame as JPEG for MJPEG stream"""
-        if self.frame_queue.empty():
-            return None
-        
-        # Get frame from queue
-        frame = self.frame_queue.get()
-        
-        # Encode as JPEG
-        ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
-        if ret:
-            return buffer.tobytes()
-        return None
+        # Keeps the stream loop encoding while clients keep polling
+        now = time.time()
+        self._jpeg_requested_at = now
+        with self._jpeg_lock:
+            # Encoding pauses without viewers (or the stream stalled); don't serve an old frame
+            if now - self._jpeg_encoded_at > MJPEG_VIEWER_TIMEOUT:
+                return None
+            return self._latest_jpeg
     
     def get_status(self) -> dict:
         """Get current status"""
@@ -490,5 +990,14 @@ class CameraService:
     
     def get_pending_clips(self) -> list:
         """Get list of clips ready for processing"""
-        return self.processed_clips.copy()
+        return list(self.processed_clips)
+    
+    def drain_pending_clips(self) -> list:
+        """Remove and return clips ready for processing, oldest first"""
+        clips = []
+        while True:
+            try:
+                clips.append(self.processed_clips.popleft())
+            except IndexError:
+                return clips
 
@@ -1,11 +1,87 @@
+import io
 import os
 import re
+import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Optional
 from gradio_client import Client
 
 logger = logging.getLogger(__name__)
 
+# Time portion of an ISO timestamp, e.g. "2024-01-01T12:34:56.789" -> "12:34:56"
+_ISO_TIME = re.compile(r'T([^.]+)')
+# Timestamp line in the LLM response, e.g. "- Time: 12:00:00 to 12:00:16 | Video: clip.mp4"
+_TIMESTAMP_LINE = re.compile(r'-\s*Time:\s*(\S+)\s+to\s+(\S+?)(?:\s*[|(]|\s*$)')
+
+# Static parts of the correlation prompt, built once at import
+_PROMPT_HEAD = """You are a video content analysis system. Your task is to find correlations between a user's query and analyzed video clip content.
+
+=== PROCESSED VIDEO CLIP ANALYSES ===
+
+"""
+
+_PROMPT_QUERY = """
+
+=== USER QUERY ===
+"""
+
+_PROMPT_TAIL = """
+
+=== YOUR TASK ===
+1. Carefully analyze each clip's content to determine if it contains ANY information relevant to the user's query.
+2. Consider semantic meaning, not just keyword matching. Look for:
+   - Direct mentions of query topics
+   - Related concepts or events
+   - Actions or objects that relate to the query
+3. If you find relevant clips, provide:
+   - A clear explanation of the correlation
+   - The exact time intervals where relevant content appears
+4. If NO clips contain relevant information (even tangentially), respond with NOT_FOUND.
+
+=== RESPONSE FORMAT ===
+
+IF RELEVANT CLIPS FOUND:
+FOUND:
+[Your detailed explanation of what was found and how it relates to the query]
+
+TIMESTAMPS:
+- Time: [start_time] to [end_time] | Video: [video_filename]
+- Time: [start_time] to [end_time] | Video: [video_filename]
+[List only the clips that actually correlate with the query]
+
+IF NO RELEVANT CLIPS FOUND:
+NOT_FOUND:
+[Brief explanation of why no relevant content was found]
+
+Be strict in your correlation assessment. Only include clips with genuine relevance to the query."""
+
+_CLIP_FMT = """CLIP #{clip_id}:
+Time Interval: {time_interval}
+Video File: {video_file}
+Content Analysis:
+{analysis}"""
+
+def _video_filename(video_path: str) -> str:
+    """Filename from a Windows or POSIX path"""
+    return os.path.basename(video_path.replace('\\', '/'))
+
+def _no_context_answer() -> Dict:
+    return {
+        "answer": "No relevant video content found to answer your query.",
+        "timestamps": [],
+        "relevant_clips": []
+    }
+
+def _error_answer(e: Exception, timestamps: List[Dict], relevant_clips: List[Dict]) -> Dict:
+    error_msg = f"Error calling Qwen2.5 Space API: {str(e)}"
+    logger.error(error_msg)
+    return {
+        "answer": f"Error generating answer: {error_msg}",
+        "timestamps": timestamps,
+        "relevant_clips": relevant_clips
+    }
+
 class LLMService:
     def __init__(self, hf_space_url: Optional[str] = None, api_token: Optional[str] = None):
         """
@@ -26,27 +102,15 @@ class LLMService:
         except Exception as e:
             logger.error(f"Failed to initialize LLM service client: {e}")
             raise
-    
-    def generate_answer(self, user_query: str, relevant_contexts: List[Dict], max_clips: int = 5) -> Dict:
-        """
-        Generate answer from user query using relevant video analysis contexts
-        
-        Args:
-            user_query: User's question/query
-            relevant_contexts: List of relevant video analyses from ChromaDB
-                              Each dict should have: document, metadata (with start_time, end_time, video_path)
-            max_clips: Maximum number of clips to include in response
-            
-        Returns:
-            dict with keys: answer, timestamps, relevant_clips
-        """
-        if not relevant_contexts:
-            return {
-                "answer": "No relevant video content found to answer your query.",
-                "timestamps": [],
-                "relevant_clips": []
-            }
         
+        # Worker threads for generate_answer_async so concurrent queries overlap
+        self._executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("LLM_WORKERS", "8")),
+            thread_name_prefix="llm"
+        )
+    
+    def _build_prompt(self, user_query: str, relevant_contexts: List[Dict], max_clips: int):
+        """Prompt plus the default timestamps/clips for the top max_clips contexts"""
         # Limit to max_clips most relevant contexts (already sorted by ChromaDB search)
         limited_contexts = relevant_contexts[:max_clips]
         
@@ -64,16 +128,15 @@ class LLMService:
             video_path = metadata.get("video_path", "unknown")
             
             # Extract time portion if ISO format
-            try:
-                if "T" in start_time:
-                    start_time = start_time.split("T")[1].split(".")[0]
-                if "T" in end_time:
-                    end_time = end_time.split("T")[1].split(".")[0]
-            except:
-                pass
+            match = _ISO_TIME.search(start_time)
+            if match:
+                start_time = match.group(1)
+            match = _ISO_TIME.search(end_time)
+            if match:
+                end_time = match.group(1)
             
             # Extract just the filename for cleaner display
-            video_filename = re.split(r'[/\\]', video_path)[-1] if video_path else "unknown"
+            video_filename = _video_filename(video_path) if video_path else "unknown"
             
             clip_data.append({
                 "clip_id": idx,
@@ -98,183 +161,164 @@ class LLMService:
             })
         
         # Build structured prompt for intelligent correlation detection
-        clips_text = "\n\n".join([
-            f"""CLIP #{clip['clip_id']}:
-Time Interval: {clip['time_interval']}
-Video File: {clip['video_file']}
-Content Analysis:
-{clip['analysis']}"""
-            for clip in clip_data
-        ])
+        buf = io.StringIO()
+        for clip in clip_data:
+            if buf.tell():
+                buf.write("\n\n")
+            buf.write(_CLIP_FMT.format_map(clip))
+        clips_text = buf.getvalue()
         
-        prompt = f"""You are a video content analysis system. Your task is to find correlations between a user's query and analyzed video clip content.
-
-=== PROCESSED VIDEO CLIP ANALYSES ===
-
-{clips_text}
-
-=== USER QUERY ===
-{user_query}
-
-=== YOUR TASK ===
-1. Carefully analyze each clip's content to determine if it contains ANY information relevant to the user's query.
-2. Consider semantic meaning, not just keyword matching. Look for:
-   - Direct mentions of query topics
-   - Related concepts or events
-   - Actions or objects that relate to the query
-3. If you find relevant clips, provide:
-   - A clear explanation of the correlation
-   - The exact time intervals where relevant content appears
-4. If NO clips contain relevant information (even tangentially), respond with NOT_FOUND.
+        prompt = f"{_PROMPT_HEAD}{clips_text}{_PROMPT_QUERY}{user_query}{_PROMPT_TAIL}"
+        return prompt, timestamps, relevant_clips
 
-=== RESPONSE FORMAT ===
-
-IF RELEVANT CLIPS FOUND:
-FOUND:
-[Your detailed explanation of what was found and how it relates to the query]
-
-TIMESTAMPS:
-- Time: [start_time] to [end_time] | Video: [video_filename]
-- Time: [start_time] to [end_time] | Video: [video_filename]
-[List only the clips that actually correlate with the query]
-
-IF NO RELEVANT CLIPS FOUND:
-NOT_FOUND:
-[Brief explanation of why no relevant content was found]
-
-Be strict in your correlation assessment. Only include clips with genuine relevance to the query."""
+    def generate_answer(self, user_query: str, relevant_contexts: List[Dict], max_clips: int = 5) -> Dict:
+        """
+        Generate answer from user query using relevant video analysis contexts
+        
+        Args:
+            user_query: User's question/query
+            relevant_contexts: List of relevant video analyses from ChromaDB
+                              Each dict should have: document, metadata (with start_time, end_time, video_path)
+            max_clips: Maximum number of clips to include in response
+            
+        Returns:
+            dict with keys: answer, timestamps, relevant_clips
+        """
+        if not relevant_contexts:
+            return _no_context_answer()
+        
+        prompt, timestamps, relevant_clips = self._build_prompt(user_query, relevant_contexts, max_clips)
+        
+        try:
+            logger.info(f"Sending query to Qwen2.5 Space: {user_query[:50]}...")
+            result = self._predict(prompt)
+            return self._parse_answer(result, timestamps, relevant_clips)
+        except Exception as e:
+            return _error_answer(e, timestamps, relevant_clips)
 
+    async def generate_answer_async(self, user_query: str, relevant_contexts: List[Dict], max_clips: int = 5) -> Dict:
+        """
+        Async variant of generate_answer for use from the event loop
+        
+        The Space round-trip runs on the service's thread pool so concurrent
+        queries overlap instead of serializing.
+        """
+        if not relevant_contexts:
+            return _no_context_answer()
+        
+        prompt, timestamps, relevant_clips = self._build_prompt(user_query, relevant_contexts, max_clips)
+        
         try:
             logger.info(f"Sending query to Qwen2.5 Space: {user_query[:50]}...")
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self._executor, self._predict, prompt)
+            return self._parse_answer(result, timestamps, relevant_clips)
+        except Exception as e:
+            return _error_answer(e, timestamps, relevant_clips)
+
+    def _predict(self, prompt: str):
+        """Blocking call to the Space API"""
+        # Based on tt.py pattern: client.predict(question="...", api_name="/ask")
+        return self.client.predict(
+            question=prompt,
+            api_name="/ask"
+        )
+
+    def _parse_answer(self, result, timestamps: List[Dict], relevant_clips: List[Dict]) -> Dict:
+        """Turn the raw Space response into answer, timestamps and relevant_clips"""
+        # Extract answer from result
+        answer = str(result) if result else "No response generated"
+        
+        # Clean up answer
+        answer = answer.strip()
+        
+        # Parse the structured response to extract timestamps
+        parsed_timestamps = []
+        parsed_clips = []
+        
+        # Check if answer indicates no correlation found
+        if answer.upper().startswith("NOT_FOUND"):
+            # Extract the explanation after NOT_FOUND:
+            explanation = answer.split(":", 1)[1].strip() if ":" in answer else "No relevant content found in the analyzed video clips."
+            logger.info("LLM determined no correlation found")
+            return {
+                "answer": explanation,
+                "timestamps": [],
+                "relevant_clips": []
+            }
+        
+        # Parse timestamps from the structured response
+        if "TIMESTAMPS:" in answer.upper():
+            # Extract the timestamps section
+            timestamps_section = answer.split("TIMESTAMPS:", 1)[1] if "TIMESTAMPS:" in answer.upper() else ""
             
-            # Use gradio_client to call the Space API
-            # Based on tt.py pattern: client.predict(question="...", api_name="/ask")
-            result = self.client.predict(
-                question=prompt,
-                api_name="/ask"
-            )
-            
-            # Extract answer from result
-            answer = str(result) if result else "No response generated"
-            
-            # Clean up answer
-            answer = answer.strip()
-            
-            # Parse the structured response to extract timestamps
-            parsed_timestamps = []
-            parsed_clips = []
-            
-            # Check if answer indicates no correlation found
-            if answer.upper().startswith("NOT_FOUND"):
-                # Extract the explanation after NOT_FOUND:
-                explanation = answer.split(":", 1)[1].strip() if ":" in answer else "No relevant content found in the analyzed video clips."
-                logger.info("LLM determined no correlation found")
-                return {
-                    "answer": explanation,
-                    "timestamps": [],
-                    "relevant_clips": []
-                }
+            # Clips by time interval for O(1) matching (first clip wins on duplicates)
+            by_interval = {}
+            for clip in relevant_clips:
+                by_interval.setdefault((clip["start_time"], clip["end_time"]), clip)
             
-            # Parse timestamps from the structured response
-            if "TIMESTAMPS:" in answer.upper():
-                # Extract the timestamps section
-                timestamps_section = answer.split("TIMESTAMPS:", 1)[1] if "TIMESTAMPS:" in answer.upper() else ""
+            # Parse each timestamp line (supports multiple formats)
+            # Format: - Time: [start] to [end] | Video: [filename]
+            # Or: - Time: [start] to [end] (Video: [filename])
+            for line in timestamps_section.split("\n"):
+                match = _TIMESTAMP_LINE.match(line.strip())
+                if not match:
+                    continue
                 
-                # Parse each timestamp line (supports multiple formats)
-                for line in timestamps_section.split("\n"):
-                    line = line.strip()
-                    if line.startswith("-") and "Time:" in line:
-                        # Extract time range and video filename
-                        # Format: - Time: [start] to [end] | Video: [filename]
-                        # Or: - Time: [start] to [end] (Video: [filename])
-                        try:
-                            # Handle both formats
-                            if "|" in line:
-                                time_part = line.split("Time:")[1].split("|")[0].strip()
-                            elif "(Video:" in line:
-                                time_part = line.split("Time:")[1].split("(Video:")[0].strip()
-                            else:
-                                time_part = line.split("Time:")[1].strip()
-                            
-                            if "to" in time_part:
-                                start, end = [t.strip() for t in time_part.split("to")]
-                                
-                                # Find matching clip from our contexts by time interval
-                                matching_clip = None
-                                for clip in relevant_clips:
-                                    if clip["start_time"] == start and clip["end_time"] == end:
-                                        matching_clip = clip
-                                        break
-                                
-                                if matching_clip:
-                                    # Ensure video_file and time_interval are included
-                                    parsed_clip = {
-                                        "video_path": matching_clip["video_path"],
-                                        "video_file": matching_clip.get("video_file", re.split(r'[/\\]', matching_clip["video_path"])[-1]),
-                                        "start_time": matching_clip["start_time"],
-                                        "end_time": matching_clip["end_time"],
-                                        "time_interval": matching_clip.get("time_interval", f"{matching_clip['start_time']} to {matching_clip['end_time']}"),
-                                        "analysis": matching_clip["analysis"]
-                                    }
-                                    parsed_timestamps.append({
-                                        "start": start,
-                                        "end": end,
-                                        "video_path": matching_clip["video_path"]
-                                    })
-                                    parsed_clips.append(parsed_clip)
-                                    logger.debug(f"Parsed timestamp: {start} to {end}")
-                        except Exception as e:
-                            logger.warning(f"Error parsing timestamp line: {line}, {e}")
-            
-            # If no timestamps were parsed but we have relevant_clips, use all of them
-            # (fallback if LLM didn't follow format exactly)
-            # Ensure all clips have video_file and time_interval
-            if not parsed_timestamps and relevant_clips:
-                parsed_timestamps = timestamps
-                # Ensure all clips have required fields for frontend
-                parsed_clips = []
-                for clip in relevant_clips:
-                    if "video_file" not in clip:
-                        clip["video_file"] = re.split(r'[/\\]', clip.get("video_path", ""))[-1] if clip.get("video_path") else "unknown"
-                    if "time_interval" not in clip:
-                        clip["time_interval"] = f"{clip.get('start_time', 'unknown')} to {clip.get('end_time', 'unknown')}"
-                    parsed_clips.append(clip)
-            
-            # Extract the answer part (before TIMESTAMPS:)
-            answer_text = answer.split("TIMESTAMPS:", 1)[0] if "TIMESTAMPS:" in answer.upper() else answer
-            answer_text = answer_text.replace("FOUND:", "").strip()
-            
-            logger.info(f"Generated answer from Qwen2.5-Instruct, found {len(parsed_timestamps)} relevant timestamps")
-            
-            # Ensure final clips have required fields
-            final_clips = parsed_clips if parsed_clips else relevant_clips
-            # Add missing fields if any
-            for clip in final_clips:
+                start, end = match.groups()
+                
+                # Find matching clip from our contexts by time interval
+                matching_clip = by_interval.get((start, end))
+                if matching_clip:
+                    # Ensure video_file and time_interval are included
+                    parsed_clip = {
+                        "video_path": matching_clip["video_path"],
+                        "video_file": matching_clip.get("video_file", _video_filename(matching_clip["video_path"])),
+                        "start_time": matching_clip["start_time"],
+                        "end_time": matching_clip["end_time"],
+                        "time_interval": matching_clip.get("time_interval", f"{matching_clip['start_time']} to {matching_clip['end_time']}"),
+                        "analysis": matching_clip["analysis"]
+                    }
+                    parsed_timestamps.append({
+                        "start": start,
+                        "end": end,
+                        "video_path": matching_clip["video_path"]
+                    })
+                    parsed_clips.append(parsed_clip)
+                    logger.debug(f"Parsed timestamp: {start} to {end}")
+        
+        # If no timestamps were parsed but we have relevant_clips, use all of them
+        # (fallback if LLM didn't follow format exactly)
+        # Ensure all clips have video_file and time_interval
+        if not parsed_timestamps and relevant_clips:
+            parsed_timestamps = timestamps
+            # Ensure all clips have required fields for frontend
+            parsed_clips = []
+            for clip in relevant_clips:
                 if "video_file" not in clip:
-                    clip["video_file"] = re.split(r'[/\\]', clip.get("video_path", ""))[-1] if clip.get("video_path") else "unknown"
+                    clip["video_file"] = _video_filename(clip["video_path"]) if clip.get("video_path") else "unknown"
                 if "time_interval" not in clip:
                     clip["time_interval"] = f"{clip.get('start_time', 'unknown')} to {clip.get('end_time', 'unknown')}"
-            
-            return {
-                "answer": answer_text,
-                "timestamps": parsed_timestamps if parsed_timestamps else timestamps,
-                "relevant_clips": final_clips
-            }
-            
-        except Exception as e:
-            error_msg = f"Error calling Qwen2.5 Space API: {str(e)}"
-            logger.error(error_msg)
-            return {
-                "answer": f"Error generating answer: {error_msg}",
-                "timestamps": timestamps,
-                "relevant_clips": relevant_clips
-            }
-        except Exception as e:
-            error_msg = f"Unexpected error: {str(e)}"
-            logger.error(error_msg)
-            return {
-                "answer": f"Error generating answer: {error_msg}",
-                "timestamps": timestamps,
-                "relevant_clips": relevant_clips
-            }
+                parsed_clips.append(clip)
+        
+        # Extract the answer part (before TIMESTAMPS:)
+        answer_text = answer.split("TIMESTAMPS:", 1)[0] if "TIMESTAMPS:" in answer.upper() else answer
+        answer_text = answer_text.replace("FOUND:", "").strip()
+        
+        logger.info(f"Generated answer from Qwen2.5-Instruct, found {len(parsed_timestamps)} relevant timestamps")
+        
+        # Ensure final clips have required fields
+        final_clips = parsed_clips if parsed_clips else relevant_clips
+        # Add missing fields if any
+        for clip in final_clips:
+            if "video_file" not in clip:
+                clip["video_file"] = _video_filename(clip["video_path"]) if clip.get("video_path") else "unknown"
+            if "time_interval" not in clip:
+                clip["time_interval"] = f"{clip.get('start_time', 'unknown')} to {clip.get('end_time', 'unknown')}"
+        
+        return {
+            "answer": answer_text,
+            "timestamps": parsed_timestamps if parsed_timestamps else timestamps,
+            "relevant_clips": final_clips
+        }
 
@@ -1,14 +1,31 @@
 import os
 import asyncio
+import functools
 import logging
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, FileResponse
+from fastapi.responses import StreamingResponse, FileResponse, JSONResponse, ORJSONResponse
 from pathlib import Path
 from contextlib import asynccontextmanager
 import threading
-import time
-from typing import List, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Any, Optional, Set, Union
+import msgspec
+
+try:
+    import orjson
+    
+    def _dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+    
+    DefaultResponse = ORJSONResponse
+except ImportError:
+    import json
+    
+    def _dumps(obj) -> str:
+        return json.dumps(obj)
+    
+    DefaultResponse = JSONResponse
 
 from models import (
     CameraInfo, StreamStartRequest, StreamStatus, ProgressUpdate,
@@ -33,23 +50,46 @@ storage_service: StorageService = None
 llm_service: LLMService = None
 
 # WebSocket connections
-active_connections: List[WebSocket] = []
+active_connections: Set[WebSocket] = set()
+# Close calls for dropped connections, referenced until they finish
+_closing_tasks: Set[asyncio.Task] = set()
 # Store the event loop for thread-safe WebSocket broadcasting
 event_loop: Optional[asyncio.AbstractEventLoop] = None
+# JSON-encoded updates waiting for the broadcaster task
+broadcast_queue: Optional[asyncio.Queue] = None
+# Seconds a client gets to accept a broadcast before it is disconnected
+BROADCAST_TIMEOUT = 0.5
 
-# Processing queue and state
-processing_queue = []
-is_processing = False
+# Processing queue and state (the queue and semaphore are created in lifespan, on the event loop)
+processing_queue: Optional["asyncio.Queue[str]"] = None
 processed_clips_count = 0
 processed_seconds = 0
 
+# Clips are uploaded/analysed concurrently; each one mostly waits on the HF Space
+QWEN_WORKERS = int(os.getenv("QWEN_WORKERS", "4"))
+inflight_slots: Optional[asyncio.Semaphore] = None
+processing_tasks: Set[asyncio.Task] = set()
+# Seconds shutdown waits for queued/in-flight clips before cancelling them
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "30"))
+# Makes count-then-store atomic across worker threads (unique clip_index) and keeps a
+# clear from interleaving with it; ChromaDB access itself is batched by StorageService
+storage_lock = threading.Lock()
+active_jobs = 0
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Initialize and cleanup services"""
-    global camera_service, video_processor, storage_service, llm_service, event_loop
+    global camera_service, video_processor, storage_service, llm_service, event_loop, broadcast_queue
+    global processing_queue, inflight_slots
     
     # Store the event loop for thread-safe WebSocket broadcasting
     event_loop = asyncio.get_running_loop()
+    # Worker threads for asyncio.to_thread: ChromaDB calls, camera probing, gradio_client fallback
+    event_loop.set_default_executor(
+        ThreadPoolExecutor(max_workers=int(os.getenv("BLOCKING_WORKERS", "8")))
+    )
+    broadcast_queue = asyncio.Queue()
+    broadcaster_task = asyncio.create_task(broadcaster())
     
     # Initialize services
     logger.info("Initializing services...")
@@ -64,6 +104,9 @@ async def lifespan(app: FastAPI):
     
     storage_service = StorageService()
     
+    # Resolved once; get_video serves files only from this directory
+    app.state.recordings_dir = _resolve_recordings_dir()
+    
     try:
         llm_service = LLMService()
     except Exception as e:
@@ -73,18 +116,51 @@ async def lifespan(app: FastAPI):
     
     logger.info("Services initialized")
     
-    # Start background processing thread
-    processing_thread = threading.Thread(target=process_video_queue, daemon=True)
-    processing_thread.start()
+    # Start background clip processing
+    processing_queue = asyncio.Queue()
+    inflight_slots = asyncio.Semaphore(QWEN_WORKERS)
+    consumer_task = asyncio.create_task(clip_consumer())
     
     yield
     
     # Cleanup
     logger.info("Shutting down...")
     if camera_service:
-        camera_service.stop_stream()
+        # May queue one last clip for the recording in progress. Runs on a worker thread:
+        # finalizing that clip blocks for a second or more. The clip is queued with
+        # call_soon_threadsafe before this returns, so join() below already counts it.
+        await asyncio.to_thread(camera_service.stop_stream)
+    
+    # Let queued and in-flight clips finish, within limits
+    try:
+        await asyncio.wait_for(processing_queue.join(), timeout=SHUTDOWN_DRAIN_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning(
+            f"Gave up on {processing_queue.qsize()} queued and {len(processing_tasks)} "
+            f"in-flight clips after {SHUTDOWN_DRAIN_TIMEOUT}s"
+        )
+    consumer_task.cancel()
+    for task in list(processing_tasks):
+        task.cancel()
+    if video_processor:
+        await video_processor.aclose()
+    
+    # Write out analyses still waiting for a batched add
+    if storage_service:
+        try:
+            await asyncio.to_thread(storage_service.flush)
+        except Exception as e:
+            logger.error(
+                f"Error flushing analyses on shutdown, {storage_service.pending_count()} "
+                f"analyses were not stored: {e}"
+            )
+    broadcaster_task.cancel()
 
-app = FastAPI(title="Camera Motion Detection Video Analysis", lifespan=lifespan)
+app = FastAPI(
+    title="Camera Motion Detection Video Analysis",
+    lifespan=lifespan,
+    default_response_class=DefaultResponse
+)
 
 # CORS middleware
 app.add_middleware(
@@ -95,49 +171,113 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-def broadcast_update(update: dict):
+_update_encoder = msgspec.json.Encoder()
+
+class ProgressPayloadWriter:
+    """Pre-encoded "progress" message; only the two counter slots are rewritten per clip
+    
+    Counters are right-aligned in fixed-width, space-padded slots (whitespace is valid
+    JSON), so no dict or encoder pass is needed. Only used from the event loop thread.
+    """
+    WIDTH = 10
+    
+    def __init__(self):
+        head = b'{"type":"progress","seconds_processed":'
+        middle = b',"clips_processed":'
+        self._buf = bytearray(head + b" " * self.WIDTH + middle + b" " * self.WIDTH + b"}")
+        self._seconds = slice(len(head), len(head) + self.WIDTH)
+        clips_start = self._seconds.stop + len(middle)
+        self._clips = slice(clips_start, clips_start + self.WIDTH)
+    
+    def render(self, seconds_processed: int, clips_processed: int) -> str:
+        if max(seconds_processed, clips_processed) >= 10 ** self.WIDTH:
+            return _encode_update(ProgressUpdate(
+                type="progress",
+                seconds_processed=seconds_processed,
+                clips_processed=clips_processed
+            ))
+        self._buf[self._seconds] = b"%*d" % (self.WIDTH, seconds_processed)
+        self._buf[self._clips] = b"%*d" % (self.WIDTH, clips_processed)
+        return self._buf.decode()
+
+progress_payload = ProgressPayloadWriter()
+
+def _encode_update(update: Union[dict, ProgressUpdate, str]) -> str:
+    if isinstance(update, str):
+        # Already encoded (ProgressPayloadWriter)
+        return update
+    if isinstance(update, msgspec.Struct):
+        return _update_encoder.encode(update).decode()
+    return _dumps(update)
+
+def broadcast_update(update: Union[dict, ProgressUpdate, str]):
     """Broadcast update to all WebSocket connections (called from background threads)"""
-    global event_loop
-    
     if not active_connections:
         return
     
-    if event_loop is None:
+    if event_loop is None or broadcast_queue is None:
         logger.warning("Event loop not available for WebSocket broadcast")
         return
     
-    disconnected = []
-    # Schedule coroutines to run in the event loop from background threads
-    for connection in active_connections:
-        try:
-            # Use run_coroutine_threadsafe to safely call async function from sync context
-            future = asyncio.run_coroutine_threadsafe(connection.send_json(update), event_loop)
-            # Optionally check for exceptions (don't wait, just check if done)
-            if future.done() and future.exception():
-                raise future.exception()
-        except Exception as e:
-            logger.warning(f"Error broadcasting to WebSocket: {e}")
-            disconnected.append(connection)
-    
-    # Remove disconnected connections
-    for conn in disconnected:
-        if conn in active_connections:
-            active_connections.remove(conn)
+    # Encode once here; the broadcaster task sends the same text to every client
+    event_loop.call_soon_threadsafe(broadcast_queue.put_nowait, _encode_update(update))
+
+async def _close_quietly(connection: WebSocket, code: int):
+    """Close a dropped connection; it may already be gone"""
+    try:
+        await connection.close(code=code)
+    except Exception:
+        pass
+
+def _prune_if_failed(connection: WebSocket, task: asyncio.Task):
+    """Done callback for a broadcast send: drop and close the connection if the send didn't succeed"""
+    if task.cancelled():
+        code = 1008  # Too slow to keep up with updates
+    elif task.exception() is not None:
+        logger.warning(f"Error broadcasting to WebSocket: {task.exception()}")
+        code = 1011
+    else:
+        return
+    if connection in active_connections:
+        active_connections.discard(connection)
+        # Closing ends the handler's receive() loop so the socket isn't left half-open
+        closing = asyncio.create_task(_close_quietly(connection, code))
+        _closing_tasks.add(closing)
+        closing.add_done_callback(_closing_tasks.discard)
+
+async def broadcaster():
+    """Send queued updates to all WebSocket connections concurrently"""
+    while True:
+        data = await broadcast_queue.get()
+        if not active_connections:
+            continue
+        
+        sends = []
+        for connection in tuple(active_connections):
+            task = asyncio.create_task(connection.send_text(data))
+            task.add_done_callback(functools.partial(_prune_if_failed, connection))
+            sends.append(task)
+        # Wait before the next message so each client receives updates in order, but
+        # never longer than BROADCAST_TIMEOUT: a stalled client is dropped, not waited on
+        _, pending = await asyncio.wait(sends, timeout=BROADCAST_TIMEOUT)
+        for task in pending:
+            # _prune_if_failed drops and closes the connection once the cancellation lands
+            task.cancel()
 
 def on_motion_detected(detected: bool):
     """Callback when motion is detected"""
-    broadcast_update({
-        "type": "motion",
-        "motion_detected": detected
-    })
+    broadcast_update(ProgressUpdate(type="motion", motion_detected=detected))
 
 def on_progress_update(event_type: str, data: Any = None):
     """Callback for progress updates"""
     global processed_clips_count, processed_seconds
     
     if event_type == "clip_ready":
-        # Add clip to processing queue
-        processing_queue.append(data)
+        # Called from the camera's writer thread; the queue belongs to the event loop
+        if event_loop is None or processing_queue is None:
+            logger.warning(f"Processing queue not available, dropping clip: {data}")
+            return
+        event_loop.call_soon_threadsafe(processing_queue.put_nowait, data)
         logger.info(f"Added clip to processing queue: {data}")
         broadcast_update({
             "type": "clip_queued",
@@ -146,72 +286,110 @@ def on_progress_update(event_type: str, data: Any = None):
     elif event_type == "clip_processed":
         processed_clips_count += 1
         processed_seconds += 16  # Each clip is 16 seconds
-        broadcast_update({
-            "type": "progress",
-            "seconds_processed": processed_seconds,
-            "clips_processed": processed_clips_count
-        })
+        broadcast_update(progress_payload.render(processed_seconds, processed_clips_count))
 
-def process_video_queue():
-    """Background thread to process video clips synchronously"""
-    global is_processing, processed_clips_count, processed_seconds
-    
+async def clip_consumer():
+    """Background task that processes queued clips concurrently, up to QWEN_WORKERS at a time"""
     while True:
-        if processing_queue and video_processor and not is_processing:
-            is_processing = True
-            clip_path = processing_queue.pop(0)
-            
+        clip_path = await processing_queue.get()
+        if not video_processor:
+            logger.warning(f"Video processor unavailable, skipping clip: {clip_path}")
+            processing_queue.task_done()
+            continue
+        
+        # Bound in-flight clips so a burst waits in processing_queue
+        await inflight_slots.acquire()
+        task = asyncio.create_task(process_clip(clip_path))
+        processing_tasks.add(task)
+        task.add_done_callback(_clip_task_done)
+
+def _clip_task_done(task: asyncio.Task):
+    processing_tasks.discard(task)
+    inflight_slots.release()
+    processing_queue.task_done()
+
+def _store_result(result: dict):
+    """Store a Qwen3-VL result in ChromaDB (runs on a worker thread)"""
+    # Keeps clip_index unique across concurrent clips; the ChromaDB add itself happens
+    # later on StorageService's flusher thread
+    with storage_lock:
+        clip_index = storage_service.count()
+        storage_service.store_analysis(
+            video_path=result["video_path"],
+            start_time=result["start_time"],
+            end_time=result["end_time"],
+            analysis=result["analysis"],
+            clip_index=clip_index
+        )
+
+def _clear_storage():
+    """Clear ChromaDB without racing a concurrent count-then-store (runs on a worker thread)"""
+    with storage_lock:
+        storage_service.clear_all()
+
+async def process_clip(clip_path: str):
+    """Process one clip through Qwen3-VL and store the analysis"""
+    global active_jobs
+    
+    active_jobs += 1
+    try:
+        logger.info(f"Processing clip: {clip_path}")
+        broadcast_update({
+            "type": "processing_started",
+            "clip_path": clip_path
+        })
+        
+        # Process video through Qwen3-VL
+        result = await video_processor.process_video_async(clip_path)
+        
+        if result.get("error"):
+            logger.error(f"Error processing clip: {result['error']}")
+            broadcast_update({
+                "type": "processing_error",
+                "clip_path": clip_path,
+                "error": result["error"]
+            })
+        else:
+            # Store in ChromaDB, keeping embedding work off the event loop
             try:
-                logger.info(f"Processing clip: {clip_path}")
-                broadcast_update({
-                    "type": "processing_started",
-                    "clip_path": clip_path
-                })
+                await asyncio.to_thread(_store_result, result)
                 
-                # Process video through Qwen3-VL
-                result = video_processor.process_video_sync(clip_path)
+                on_progress_update("clip_processed")
+                logger.info(f"Successfully processed and stored clip: {clip_path}")
                 
-                if result.get("error"):
-                    logger.error(f"Error processing clip: {result['error']}")
-                    broadcast_update({
-                        "type": "processing_error",
-                        "clip_path": clip_path,
-                        "error": result["error"]
-                    })
-                else:
-                    # Store in ChromaDB
-                    try:
-                        clip_index = len(storage_service.get_all_analyses())
-                        storage_service.store_analysis(
-                            video_path=result["video_path"],
-                            start_time=result["start_time"],
-                            end_time=result["end_time"],
-                            analysis=result["analysis"],
-                            clip_index=clip_index
-                        )
-                        
-                        on_progress_update("clip_processed")
-                        logger.info(f"Successfully processed and stored clip: {clip_path}")
-                        
-                        broadcast_update({
-                            "type": "processing_complete",
-                            "clip_path": clip_path
-                        })
-                    except Exception as e:
-                        logger.error(f"Error storing analysis: {e}")
-            
-            except Exception as e:
-                logger.error(f"Error in video processing: {e}")
                 broadcast_update({
-                    "type": "processing_error",
-                    "clip_path": clip_path,
-                    "error": str(e)
+                    "type": "processing_complete",
+                    "clip_path": clip_path
                 })
-            
-            finally:
-                is_processing = False
-        
-        time.sleep(1)  # Check queue every second
+            except Exception as e:
+                logger.error(f"Error storing analysis: {e}")
+    
+    except Exception as e:
+        logger.error(f"Error in video processing: {e}")
+        broadcast_update({
+            "type": "processing_error",
+            "clip_path": clip_path,
+            "error": str(e)
+        })
+    
+    finally:
+        active_jobs -= 1
+
+def _resolve_recordings_dir() -> Optional[Path]:
+    """Absolute recordings directory: the camera service's, otherwise the first common location that exists"""
+    if camera_service and camera_service.recordings_dir.exists():
+        return camera_service.recordings_dir.resolve()
+    
+    possible_paths = [
+        Path("backend/backend/recordings"),  # Correct location (when running from backend/)
+        Path("backend/backend/backend/recordings"),
+        Path("backend/recordings"),
+        Path("recordings"),
+    ]
+    for path in possible_paths:
+        if path.exists():
+            return path.resolve()
+    return None
 
 @app.get("/")
 async def root():
@@ -223,7 +401,8 @@ async def list_cameras():
     if not camera_service:
         raise HTTPException(status_code=503, detail="Camera service not initialized")
     
-    cameras = camera_service.list_cameras()
+    # Probing devices can take seconds; don't block the event loop
+    cameras = await asyncio.to_thread(camera_service.list_cameras)
     return [CameraInfo(**cam) for cam in cameras]
 
 @app.post("/api/stream/start")
@@ -275,17 +454,19 @@ async def get_stream_status():
 async def websocket_endpoint(websocket: WebSocket):
     """WebSocket endpoint for real-time updates"""
     await websocket.accept()
-    active_connections.append(websocket)
+    active_connections.add(websocket)
     
     try:
+        # Keepalive uses uvicorn's protocol-level PING frames (ws_ping_interval), so
+        # client messages are only drained until the socket closes
         while True:
-            # Keep connection alive and handle any client messages
-            data = await websocket.receive_text()
-            # Echo back or handle commands if needed
-            await websocket.send_json({"type": "ping", "message": "pong"})
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
     except WebSocketDisconnect:
-        if websocket in active_connections:
-            active_connections.remove(websocket)
+        pass
+    finally:
+        active_connections.discard(websocket)
 
 @app.get("/api/progress")
 async def get_progress():
@@ -293,38 +474,70 @@ async def get_progress():
     return {
         "seconds_processed": processed_seconds,
         "clips_processed": processed_clips_count,
-        "queue_length": len(processing_queue),
-        "is_processing": is_processing
+        "queue_length": processing_queue.qsize() if processing_queue else 0,
+        "is_processing": active_jobs > 0
     }
 
+@app.get("/api/health")
+async def health():
+    """Liveness plus queue depths, for tuning worker and broadcast limits"""
+    return {
+        "status": "ok",
+        "queue": processing_queue.qsize() if processing_queue else 0,
+        "inflight": active_jobs,
+        "max_inflight": QWEN_WORKERS,
+        "ws_conns": len(active_connections),
+        "broadcast_backlog": broadcast_queue.qsize() if broadcast_queue else 0
+    }
+
+# Chunk size for ranged video responses
+VIDEO_CHUNK_SIZE = 1 << 20
+
+def _parse_range(range_header: str, file_size: int) -> Optional[tuple]:
+    """Parse a single 'bytes=start-end' range into inclusive offsets, or None to serve the whole file"""
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    start_text, _, end_text = spec.strip().partition("-")
+    try:
+        if start_text:
+            start = int(start_text)
+            end = int(end_text) if end_text else file_size - 1
+        else:
+            # Suffix range: the last N bytes
+            start = max(file_size - int(end_text), 0)
+            end = file_size - 1
+    except ValueError:
+        return None
+    if start >= file_size or start > end:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{file_size}"}
+        )
+    return start, min(end, file_size - 1)
+
+def _iter_file_range(path: Path, start: int, end: int):
+    """Yield bytes start..end (inclusive) of a file; run in Starlette's threadpool"""
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(VIDEO_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
 @app.get("/api/video/{video_filename:path}")
-async def get_video(video_filename: str):
+async def get_video(video_filename: str, request: Request):
     """Serve video files - converts AVI to MP4 for better streaming compatibility"""
     import os
     import subprocess
     import shutil
     
-    # Security: Only allow files from recordings directory
-    # Use the camera service's recordings directory if available, otherwise check common locations
-    base_dir = None
-    if camera_service:
-        base_dir = camera_service.recordings_dir
-        if not base_dir.exists():
-            base_dir = None
-    
-    # Fallback to checking common locations
-    if not base_dir:
-        possible_paths = [
-            Path("backend/backend/recordings").resolve(),  # Correct location (when running from backend/)
-            Path("backend/backend/backend/recordings").resolve(),
-            Path("backend/recordings").resolve(),
-            Path("recordings").resolve(),
-        ]
-        for path in possible_paths:
-            if path.exists():
-                base_dir = path
-                break
-    
+    # Security: Only allow files from the recordings directory, resolved once at startup
+    base_dir = getattr(request.app.state, "recordings_dir", None)
     if not base_dir:
         raise HTTPException(status_code=404, detail="Recordings directory not found")
     
@@ -332,12 +545,12 @@ async def get_video(video_filename: str):
     video_filename = os.path.basename(video_filename)
     video_path = base_dir / video_filename
     
-    # Final security check
-    video_path = video_path.resolve()
-    if not str(video_path).startswith(str(base_dir.resolve())):
+    # Final security check: base_dir is already resolved and basename() leaves no
+    # separators, so a lexical comparison is enough (only "." / ".." could escape)
+    if video_filename in ("", ".", "..") or not video_path.is_relative_to(base_dir):
         raise HTTPException(status_code=403, detail="Access denied")
     
-    if not video_path.exists():
+    if not video_path.is_file():
         logger.error(f"Video file not found: {video_path}")
         raise HTTPException(status_code=404, detail=f"Video not found: {video_filename}")
     
@@ -404,17 +617,39 @@ async def get_video(video_filename: str):
         elif video_filename.lower().endswith('.mp4'):
             content_type = "video/mp4"
     
+    # Stat once; the result is reused for the range check and the response headers
+    stat_result = serve_path.stat()
+    file_size = stat_result.st_size
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f'inline; filename="{final_filename}"'
+    }
+    
+    # Browsers seek with Range requests; answer those with 206 and only the requested bytes
+    range_header = request.headers.get("range")
+    byte_range = _parse_range(range_header, file_size) if range_header else None
+    if byte_range is not None:
+        start, end = byte_range
+        logger.debug(f"Serving bytes {start}-{end}/{file_size} of {serve_path}")
+        headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+        headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(
+            _iter_file_range(serve_path, start, end),
+            status_code=206,
+            media_type=content_type,
+            headers=headers
+        )
+    
     # Log video serving for debugging
-    logger.info(f"Serving video file: {serve_path} (size: {serve_path.stat().st_size} bytes)")
+    logger.info(f"Serving video file: {serve_path} (size: {file_size} bytes)")
     
+    # Whole file: FileResponse streams it (sendfile where the server supports it)
     return FileResponse(
         path=str(serve_path),
         media_type=content_type,
         filename=final_filename,
-        headers={
-            "Accept-Ranges": "bytes",
-            "Content-Disposition": f'inline; filename="{final_filename}"'
-        }
+        stat_result=stat_result,
+        headers=headers
     )
 
 @app.post("/api/clear-database")
@@ -424,7 +659,7 @@ async def clear_database():
         raise HTTPException(status_code=503, detail="Storage service not initialized")
     
     try:
-        storage_service.clear_all()
+        await asyncio.to_thread(_clear_storage)
         logger.info("Database cleared by user")
         
         # Also clear processing stats
@@ -446,8 +681,10 @@ async def query_videos(request: QueryRequest):
     if not llm_service:
         raise HTTPException(status_code=503, detail="LLM service not initialized. Set HF_API_TOKEN environment variable.")
     
-    # Search ChromaDB for relevant analyses
-    relevant_contexts = storage_service.search_analyses(
+    # Search ChromaDB for relevant analyses; the query embedding is CPU-bound, so keep
+    # it off the event loop
+    relevant_contexts = await asyncio.to_thread(
+        storage_service.search_analyses,
         query=request.query,
         top_k=request.top_k or 5
     )
@@ -460,7 +697,7 @@ async def query_videos(request: QueryRequest):
         )
     
     # Generate answer using LLM (limit to top_k clips)
-    result = llm_service.generate_answer(
+    result = await llm_service.generate_answer_async(
         request.query, 
         relevant_contexts,
         max_clips=request.top_k or 5
@@ -474,5 +711,5 @@ async def query_videos(request: QueryRequest):
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run(app, host="0.0.0.0", port=8000, ws_ping_interval=20, ws_ping_timeout=20)
 
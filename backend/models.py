@@ -1,3 +1,4 @@
+import msgspec
 from pydantic import BaseModel
 from typing import Optional, List, Dict
 from datetime import datetime
@@ -18,7 +19,9 @@ class StreamStatus(BaseModel):
     motion_detected: bool = False
     is_recording: bool = False
 
-class ProgressUpdate(BaseModel):
+# Internal WebSocket message: built by the server only, so no validation is needed.
+# Unset fields are left out of the encoded JSON.
+class ProgressUpdate(msgspec.Struct, omit_defaults=True):
     type: str  # "progress", "motion", "recording", etc.
     seconds_processed: Optional[int] = None
     clips_processed: Optional[int] = None
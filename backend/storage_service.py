@@ -1,12 +1,27 @@
 import chromadb
 from chromadb.config import Settings
+from chromadb.utils import embedding_functions
+import hashlib
 import logging
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 from typing import List, Dict, Optional
 from pathlib import Path
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+# Analyses are added to ChromaDB in batches: every FLUSH_INTERVAL seconds, or as soon
+# as FLUSH_BATCH_SIZE are pending
+FLUSH_INTERVAL = 2.0
+FLUSH_BATCH_SIZE = 32
+# Failed adds of the same batch before it is dropped (e.g. a duplicate id never succeeds)
+MAX_FLUSH_ATTEMPTS = 3
+# Cached search results (cleared on every write) and query embeddings
+SEARCH_CACHE_SIZE = 256
+EMBEDDING_CACHE_SIZE = 1024
+
 class StorageService:
     def __init__(self, persist_directory: str = "backend/chroma_db"):
         """
@@ -24,15 +39,105 @@ class StorageService:
             settings=Settings(anonymized_telemetry=False)
         )
         
+        # ChromaDB's default model, shared by the collection (documents) and _embed_query
+        # (queries, called directly so their embeddings can be cached)
+        self._embedding_function = embedding_functions.DefaultEmbeddingFunction()
+        
         # Get or create collection with embedding function for semantic search
-        # ChromaDB will use default embedding function if not specified
         self.collection = self.client.get_or_create_collection(
             name="video_analyses",
-            metadata={"hnsw:space": "cosine"}  # Use cosine similarity for semantic search
+            metadata={"hnsw:space": "cosine"},  # Use cosine similarity for semantic search
+            embedding_function=self._embedding_function
         )
         
+        self._embedding_cache: "OrderedDict[bytes, list]" = OrderedDict()
+        self._embedding_lock = threading.Lock()
+        self._search_cached = lru_cache(maxsize=SEARCH_CACHE_SIZE)(self._search)
+        # Part of every cached search's key and bumped after each write, so a search that
+        # raced a write is cached under a key no later lookup uses
+        self._generation = 0
+        
+        # Analyses waiting for the next batched add: (doc_id, document, metadata)
+        self._pending: List[tuple] = []
+        self._pending_lock = threading.Lock()
+        # Held for the whole add so a reader's flush() waits for in-progress writes
+        self._flush_lock = threading.Lock()
+        self._failed_flushes = 0  # Consecutive failed adds of the batch at the front of _pending
+        self._flush_requested = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+        
         logger.info(f"Initialized ChromaDB storage at: {self.persist_directory}")
     
+    def _flush_loop(self):
+        """Background thread that periodically adds pending analyses"""
+        while True:
+            self._flush_requested.wait(FLUSH_INTERVAL)
+            self._flush_requested.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing analyses to ChromaDB: {e}")
+    
+    def flush(self):
+        """Add all pending analyses to the collection in one batch"""
+        with self._flush_lock:
+            with self._pending_lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return
+            
+            ids, documents, metadatas = map(list, zip(*batch))
+            try:
+                # ChromaDB embeds the whole batch in one pass
+                self.collection.add(
+                    documents=documents,
+                    metadatas=metadatas,
+                    ids=ids
+                )
+            except Exception:
+                self._failed_flushes += 1
+                if self._failed_flushes >= MAX_FLUSH_ATTEMPTS:
+                    # Retrying a batch that always fails would block every later analysis
+                    self._failed_flushes = 0
+                    logger.error(f"Dropping {len(batch)} analyses after {MAX_FLUSH_ATTEMPTS} failed adds: {ids}")
+                else:
+                    # Put the batch back ahead of anything queued meanwhile so the next flush retries it
+                    with self._pending_lock:
+                        self._pending[:0] = batch
+                raise
+            self._failed_flushes = 0
+            self._invalidate_searches()
+            logger.info(f"Flushed {len(batch)} analyses to ChromaDB")
+    
+    def _invalidate_searches(self):
+        """Retire cached search results after a write"""
+        self._generation += 1
+        self._search_cached.cache_clear()
+    
+    def _try_flush(self):
+        """flush() for read paths: a failed add is logged, and the read goes ahead without it"""
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Error flushing analyses to ChromaDB: {e}")
+    
+    def _embed_query(self, query: str) -> list:
+        """Embedding for a query string, reused across repeated queries"""
+        key = hashlib.blake2b(query.encode("utf-8"), digest_size=16).digest()
+        with self._embedding_lock:
+            embedding = self._embedding_cache.get(key)
+            if embedding is not None:
+                self._embedding_cache.move_to_end(key)
+                return embedding
+        
+        embedding = self._embedding_function([query])[0]
+        with self._embedding_lock:
+            self._embedding_cache[key] = embedding
+            if len(self._embedding_cache) > EMBEDDING_CACHE_SIZE:
+                self._embedding_cache.popitem(last=False)
+        return embedding
+    
     def store_analysis(self, video_path: str, start_time: str, end_time: str, 
                       analysis: str, clip_index: Optional[int] = None) -> str:
         """
@@ -62,15 +167,13 @@ class StorageService:
             "clip_index": str(clip_index) if clip_index is not None else "0"
         }
         
-        # Add document to collection
-        # ChromaDB will automatically generate embeddings from the document text
-        self.collection.add(
-            documents=[analysis],
-            metadatas=[metadata],
-            ids=[doc_id]
-        )
+        # Queue for the next batched add; ChromaDB generates embeddings on flush
+        with self._pending_lock:
+            self._pending.append((doc_id, analysis, metadata))
+            if len(self._pending) >= FLUSH_BATCH_SIZE:
+                self._flush_requested.set()
         
-        logger.info(f"Stored analysis for video: {video_path}")
+        logger.info(f"Queued analysis for video: {video_path}")
         return doc_id
     
     def search_analyses(self, query: str, top_k: int = 5, min_relevance: float = 0.5) -> List[Dict]:
@@ -88,23 +191,31 @@ class StorageService:
         if not query:
             return []
         
+        try:
+            # Read-after-write: include analyses still waiting for a batched add
+            self.flush()
+            cached = self._search_cached(query, top_k, min_relevance, self._generation)
+        except Exception as e:
+            logger.error(f"ChromaDB query error: {e}")
+            return []
+        # Copies so callers can't alter cached entries
+        return [dict(result) for result in cached]
+    
+    def _search(self, query: str, top_k: int, min_relevance: float, generation: int) -> tuple:
+        """Uncached search; results are cached until the next write (generation is only a cache key)"""
         # Get total count first to avoid querying more than exists
         total_count = self.collection.count()
         if total_count == 0:
-            return []
+            return ()
         
         # Limit top_k to actual number of documents
         effective_top_k = min(top_k, total_count)
         
-        try:
-            # Query collection with semantic search
-            results = self.collection.query(
-                query_texts=[query],
-                n_results=effective_top_k
-            )
-        except Exception as e:
-            logger.error(f"ChromaDB query error: {e}")
-            return []
+        # Query collection with semantic search; errors propagate so they aren't cached
+        results = self.collection.query(
+            query_embeddings=[self._embed_query(query)],
+            n_results=effective_top_k
+        )
         
         # Format results and filter by relevance threshold
         formatted_results = []
@@ -148,10 +259,24 @@ class StorageService:
                 logger.info(f"Result similarities: {', '.join(similarities)}")
         
         logger.info(f"Returning {len(formatted_results)} relevant analyses (limited to top_k={top_k}) for query: '{query[:50]}...'")
-        return formatted_results
+        return tuple(formatted_results)
+    
+    def pending_count(self) -> int:
+        """Number of analyses waiting for the next batched add"""
+        with self._pending_lock:
+            return len(self._pending)
+    
+    def count(self) -> int:
+        """Number of stored analyses, including ones waiting for the next batched add"""
+        # _flush_lock keeps a batch from being counted twice (or not at all) mid-flush
+        with self._flush_lock:
+            with self._pending_lock:
+                pending = len(self._pending)
+            return self.collection.count() + pending
     
     def get_all_analyses(self) -> List[Dict]:
         """Get all stored analyses"""
+        self._try_flush()
         results = self.collection.get()
         
         formatted_results = []
@@ -167,15 +292,26 @@ class StorageService:
     
     def delete_analysis(self, doc_id: str):
         """Delete an analysis by ID"""
+        self._try_flush()
         self.collection.delete(ids=[doc_id])
+        self._invalidate_searches()
         logger.info(f"Deleted analysis: {doc_id}")
     
     def clear_all(self):
         """Clear all stored analyses (use with caution)"""
+        # Pending analyses would be deleted right after being added; drop them instead,
+        # which also clears a batch that keeps failing
+        with self._flush_lock:
+            with self._pending_lock:
+                dropped, self._pending = len(self._pending), []
+            self._failed_flushes = 0
+        if dropped:
+            logger.warning(f"Dropped {dropped} pending analyses")
         # Get all IDs and delete them
         results = self.collection.get()
         if results['ids']:
             self.collection.delete(ids=results['ids'])
+            self._invalidate_searches()
             logger.warning(f"Cleared {len(results['ids'])} video analyses from database")
         else:
             logger.info("Database already empty")
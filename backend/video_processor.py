@@ -1,12 +1,81 @@
 import os
+import json
+import uuid
+import asyncio
 import logging
+import importlib.util
 from typing import Optional
+from urllib.parse import quote
+import aiofiles
+import httpx
 from gradio_client import Client, handle_file
 from datetime import datetime
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
 
+# Bytes read from the clip per socket write during streaming uploads
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Pooled connections kept open to the Space between clips (one per concurrent clip is plenty)
+MAX_KEEPALIVE_CONNECTIONS = 8
+KEEPALIVE_EXPIRY = 300  # seconds; clips arrive at most every ~16 s while motion continues
+# HTTP/2 lets concurrent async clips share one connection; needs the optional h2 package
+_HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+# Marks an SSE line that did not finish the event stream
+_SSE_PENDING = object()
+# Statuses meaning the Space doesn't expose Gradio's REST upload/call routes
+_PROTOCOL_MISMATCH_STATUSES = (404, 405, 422)
+
+def _is_protocol_mismatch(error: Exception) -> bool:
+    """Whether a failed direct call means the Space needs gradio_client, not just a retry later"""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in _PROTOCOL_MISMATCH_STATUSES
+    # Unexpected JSON/SSE shape, or a gradio_client without the REST attributes
+    return isinstance(error, (ValueError, KeyError, IndexError, AttributeError))
+
+def _parse_sse_line(line: str, event: Optional[str]) -> tuple:
+    """Feed one server-sent event line; returns (current event, result or _SSE_PENDING)"""
+    if line.startswith("event:"):
+        return line[len("event:"):].strip(), _SSE_PENDING
+    if line.startswith("data:") and event in ("complete", "error"):
+        data = json.loads(line[len("data:"):].strip() or "null")
+        if event == "error":
+            raise RuntimeError(f"Qwen3-VL Space error: {data}")
+        return event, data[0] if isinstance(data, list) and len(data) == 1 else data
+    return event, _SSE_PENDING
+
+class _MultipartFile:
+    """Single-file multipart/form-data body read from disk on demand
+    
+    Streamed in blocks with a Content-Length, so the clip is never held in memory as
+    a whole (httpx's files= builds the full body first).
+    """
+    
+    def __init__(self, path: str, field: str = "files"):
+        self.boundary = uuid.uuid4().hex
+        self.path = path
+        filename = os.path.basename(path)
+        self.head = (f"--{self.boundary}\r\n"
+                     f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+                     f"Content-Type: application/octet-stream\r\n\r\n").encode()
+        self.tail = f"\r\n--{self.boundary}--\r\n".encode()
+        self._length = len(self.head) + os.path.getsize(path) + len(self.tail)
+    
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+    
+    def __len__(self) -> int:
+        return self._length
+    
+    async def aiter_chunks(self):
+        """The body as an async iterator with non-blocking file reads"""
+        yield self.head
+        async with aiofiles.open(self.path, "rb") as f:
+            while chunk := await f.read(UPLOAD_CHUNK_SIZE):
+                yield chunk
+        yield self.tail
+
 class VideoProcessor:
     def __init__(self, hf_space_url: Optional[str] = None, hf_token: Optional[str] = None):
         """
@@ -31,6 +100,94 @@ class VideoProcessor:
         except Exception as e:
             logger.error(f"Failed to initialize Qwen3-VL client: {e}")
             raise
+        
+        # Keep-alive client for direct REST calls, created on first use inside the running event loop
+        self._async_client: Optional[httpx.AsyncClient] = None
+        # Cleared if the Space doesn't speak the REST protocol; gradio_client is used instead
+        self._raw_upload = True
+        # Base URL at which the Space can fetch clips from this API (e.g. "http://host:8000").
+        # When set, clips are passed to the Space by URL instead of being uploaded.
+        self.clip_base_url = os.getenv("CLIP_BASE_URL", "").rstrip("/") or None
+    
+    def _clip_url_payload(self, video_path: str) -> Optional[dict]:
+        """Gradio file payload pointing at the clip's /api/video URL, or None if not configured"""
+        if not self.clip_base_url:
+            return None
+        filename = os.path.basename(video_path)
+        url = f"{self.clip_base_url}/api/video/{quote(filename)}"
+        return {
+            "path": url,
+            "url": url,
+            "orig_name": filename,
+            "meta": {"_type": "gradio.FileData"}
+        }
+    
+    async def _predict_raw_async(self, video_path: str):
+        """Upload the clip as a streamed multipart body and run /predict over Gradio's REST API"""
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(
+                # The transport owns the pool, so http2 and limits are set on it
+                transport=httpx.AsyncHTTPTransport(
+                    http2=_HTTP2_AVAILABLE,
+                    retries=2,
+                    limits=httpx.Limits(
+                        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                        keepalive_expiry=KEEPALIVE_EXPIRY
+                    )
+                ),
+                headers=getattr(self.client, "headers", {}) or {},
+                timeout=httpx.Timeout(300, read=600)
+            )
+        client = self._async_client
+        base_url = self.client.src_prefixed
+        
+        video = self._clip_url_payload(video_path)
+        if video is None:
+            body = _MultipartFile(video_path)
+            response = await client.post(
+                self.client.upload_url,
+                content=body.aiter_chunks(),
+                headers={"Content-Type": body.content_type, "Content-Length": str(len(body))}
+            )
+            response.raise_for_status()
+            video = {
+                "path": response.json()[0],
+                "orig_name": os.path.basename(video_path),
+                "meta": {"_type": "gradio.FileData"}
+            }
+        
+        response = await client.post(
+            f"{base_url}call/predict",
+            json={"data": [{"video": video, "subtitles": None}, self.prompt]}
+        )
+        response.raise_for_status()
+        event_id = response.json()["event_id"]
+        
+        # Result arrives as a server-sent event stream: "event: <type>" then "data: <json>"
+        async with client.stream("GET", f"{base_url}call/predict/{event_id}") as response:
+            response.raise_for_status()
+            event = None
+            async for line in response.aiter_lines():
+                event, result = _parse_sse_line(line, event)
+                if result is not _SSE_PENDING:
+                    return result
+        raise RuntimeError("Qwen3-VL Space closed the event stream without a result")
+    
+    async def aclose(self):
+        """Close the async HTTP client"""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+    
+    def _predict(self, video_path: str):
+        """Run the Space on a clip through gradio_client"""
+        # file() function validates and handles file paths/URLs
+        video = self._clip_url_payload(video_path) or handle_file(video_path)
+        return self.client.predict(
+            video_file={"video": video},
+            prompt=self.prompt,
+            api_name="/predict"
+        )
     
     def process_video(self, video_path: str) -> dict:
         """
@@ -53,13 +210,70 @@ class VideoProcessor:
         try:
             logger.info(f"Processing video: {video_path}")
             
-            # Use gradio_client to process video
-            # file() function validates and handles file paths/URLs
-            result = self.client.predict(
-                video_file={"video": handle_file(video_path)},
-                prompt=self.prompt,
-                api_name="/predict"
-            )
+            result = self._predict(video_path)
+            
+            end_time = datetime.now()
+            
+            # Extract analysis text from result
+            analysis_text = str(result) if result else "No analysis generated"
+            
+            logger.info(f"Successfully processed video: {video_path}")
+            
+            return {
+                "video_path": video_path,
+                "start_time": start_time.isoformat(),
+                "end_time": end_time.isoformat(),
+                "analysis": analysis_text,
+                "error": None
+            }
+            
+        except Exception as e:
+            end_time = datetime.now()
+            error_msg = str(e)
+            logger.error(f"Error processing video {video_path}: {error_msg}")
+            
+            return {
+                "video_path": video_path,
+                "start_time": start_time.isoformat(),
+                "end_time": end_time.isoformat(),
+                "analysis": None,
+                "error": error_msg
+            }
+    
+    async def process_video_async(self, video_path: str) -> dict:
+        """
+        Process a single video clip through Qwen3-VL without blocking the event loop
+        
+        Args:
+            video_path: Path to video file
+            
+        Returns:
+            dict with keys: video_path, start_time, end_time, analysis, error
+        """
+        if not self.client:
+            raise RuntimeError("Qwen3-VL client not initialized")
+        
+        if not os.path.exists(video_path):
+            raise FileNotFoundError(f"Video file not found: {video_path}")
+        
+        if not self._raw_upload:
+            # Space needs gradio_client; run it on a worker thread instead
+            return await asyncio.to_thread(self.process_video, video_path)
+        
+        start_time = datetime.now()
+        
+        try:
+            logger.info(f"Processing video: {video_path}")
+            try:
+                result = await self._predict_raw_async(video_path)
+            except Exception as e:
+                # Timeouts, connection errors and 5xx are reported for this clip only
+                if not _is_protocol_mismatch(e):
+                    raise
+                # Protocol mismatch (older/newer Gradio) - stick with gradio_client from now on
+                logger.warning(f"Direct Space upload failed, using gradio_client instead: {e}")
+                self._raw_upload = False
+                return await asyncio.to_thread(self.process_video, video_path)
             
             end_time = datetime.now()
             